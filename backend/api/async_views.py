@@ -0,0 +1,97 @@
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework.response import Response
+
+
+class AsyncDispatchMixin:
+    """Асинхронный dispatch для представлений DRF.
+
+    DRF 3.14 вызывает обработчики только синхронно. Здесь dispatch —
+    корутина: async-обработчики (чтение через асинхронный ORM)
+    выполняются в цикле событий, а обычные (запись, действия) — в
+    потоке через sync_to_async, как Django запускает синхронные
+    представления под ASGI. Аутентификация и проверка прав тоже
+    обращаются к базе, поэтому идут в потоке. Под WSGI Django сам
+    запускает такое представление через async_to_sync.
+    """
+    view_is_async = True
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        # ViewSetMixin.as_view собирает свою функцию, её тоже помечаем.
+        return markcoroutinefunction(super().as_view(*args, **kwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(
+                    request, *args, **kwargs
+                )
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def afilter_queryset(self, queryset):
+        # Фильтры могут читать базу (права, реестр тегов, избранное).
+        return await sync_to_async(self.filter_queryset)(queryset)
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(
+            queryset, self.request, view=self
+        )
+
+    async def aget_object(self):
+        """get_object на асинхронном ORM."""
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{
+                self.lookup_field: self.kwargs[lookup_url_kwarg]
+            })
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class AsyncReadOnlyMixin(AsyncDispatchMixin):
+    """list и retrieve на асинхронном ORM для простых справочников.
+
+    Сериализаторы таких представлений не обращаются к базе, поэтому
+    данные собираются прямо в цикле событий.
+    """
+
+    async def list(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        objects = [obj async for obj in queryset]
+        return Response(self.get_serializer(objects, many=True).data)
+
+    async def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(await self.aget_object()).data)
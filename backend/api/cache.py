@@ -0,0 +1,158 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from .db_router import primary
+
+
+class RecipeResponseCache:
+    """Кэш ответов RecipeViewSet для анонимных пользователей.
+
+    Ключи содержат поколения: общее (справочники), списков и версию
+    отдельного рецепта. Инвалидация меняет поколение, и старые записи
+    просто перестают читаться и вытесняются по таймауту. Поколения
+    хранятся как случайные токены, поэтому вытеснение счётчика из кэша
+    не может вернуть к жизни устаревшие ответы. Промах читает из
+    основной базы: отстающая реплика положила бы под новое поколение
+    старые данные.
+
+    Вместе с ответом хранится версия данных, из которой view строит
+    ETag и Last-Modified. Запись с другой версией считается промахом:
+    иначе воркер, не увидевший инвалидацию, отдал бы старое тело под
+    новым ETag, и клиент получал бы на него 304.
+    """
+
+    HIT = 'hit'
+    MISS = 'miss'
+
+    def __init__(self, prefix='recipes', timeout=None):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix, *map(str, parts)))
+
+    def _generations(self, *names):
+        keys = [self._key('gen', name) for name in names]
+        values = cache.get_many(keys)
+        missing = {key: uuid.uuid4().hex for key in keys if key not in values}
+        if missing:
+            cache.set_many(missing, None)
+            values.update(missing)
+        return [values[key] for key in keys]
+
+    def _bump(self, *names):
+        # После коммита, иначе параллельный запрос успеет закэшировать
+        # ещё не изменённые данные под новым поколением.
+        generations = {
+            self._key('gen', name): uuid.uuid4().hex for name in names
+        }
+        transaction.on_commit(lambda: cache.set_many(generations, None))
+
+    @staticmethod
+    def normalize_query(request):
+        """Параметры запроса в каноническом виде."""
+        return '&'.join(
+            f'{name}={value}'
+            for name in sorted(request.query_params)
+            for value in sorted(request.query_params.getlist(name))
+        )
+
+    def _request_part(self, request):
+        # В ответах абсолютные URL картинок, поэтому хост входит в ключ.
+        raw = f'{request.scheme}://{request.get_host()}?'
+        raw += self.normalize_query(request)
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def list_key(self, request):
+        common, lists = self._generations('all', 'list')
+        return self._key('list', common, lists, self._request_part(request))
+
+    def detail_key(self, request, pk):
+        common, recipe = self._generations('all', f'recipe:{pk}')
+        return self._key(
+            'detail', pk, common, recipe, self._request_part(request)
+        )
+
+    @staticmethod
+    def _cached_data(entry, version):
+        """Данные записи (версия, данные), если версия совпадает."""
+        if isinstance(entry, tuple) and entry[0] == version:
+            return entry[1]
+        return None
+
+    def respond(self, key, get_response, version=None):
+        data = self._cached_data(cache.get(key), version)
+        if data is not None:
+            self._count(self.HIT)
+            return Response(data, headers={'X-Cache': 'HIT'})
+        self._count(self.MISS)
+        with primary():
+            response = get_response()
+        if response.status_code == 200:
+            # Основная база не отстаёт от версии, прочитанной до неё,
+            # так что тело под версией не старше её.
+            cache.set(key, (version, response.data), self.timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    async def arespond(self, key, get_response, version=None):
+        """respond для корутины get_response."""
+        data = self._cached_data(await cache.aget(key), version)
+        if data is not None:
+            await self._acount(self.HIT)
+            return Response(data, headers={'X-Cache': 'HIT'})
+        await self._acount(self.MISS)
+        with primary():
+            response = await get_response()
+        if response.status_code == 200:
+            await cache.aset(key, (version, response.data), self.timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    async def _acount(self, name):
+        key = self._key('stats', name)
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, 1, None)
+
+    def _count(self, name):
+        key = self._key('stats', name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def stats(self):
+        keys = {
+            name: self._key('stats', name) for name in (self.HIT, self.MISS)
+        }
+        values = cache.get_many(keys.values())
+        hits = values.get(keys[self.HIT], 0)
+        misses = values.get(keys[self.MISS], 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+
+    def reset_stats(self):
+        cache.delete_many(
+            [self._key('stats', self.HIT), self._key('stats', self.MISS)]
+        )
+
+    def invalidate_recipes(self, *pks):
+        """Рецепты изменились: сбросить их детали и все списки."""
+        self._bump('list', *(f'recipe:{pk}' for pk in pks))
+
+    def invalidate_all(self):
+        self._bump('all')
+
+
+recipe_cache = RecipeResponseCache(timeout=settings.RECIPE_CACHE_TIMEOUT)
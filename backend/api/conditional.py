@@ -0,0 +1,60 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .cache import RecipeResponseCache
+from .memberships import recipe_memberships
+
+
+def membership_part(user, memberships=None):
+    """Часть ETag, зависящая от пользователя: флаги в ответе."""
+    if not user.is_authenticated:
+        return 'anonymous'
+    if memberships is None:
+        memberships = recipe_memberships.get(user)
+    return ';'.join(
+        f'{kind}=' + ','.join(map(str, sorted(ids)))
+        for kind, ids in sorted(memberships.items())
+    )
+
+
+def make_etag(request, *parts, memberships=None):
+    """Сильный ETag: версия данных, пользователь и вид ответа.
+
+    memberships — уже загруженные множества пользователя, иначе они
+    читаются из recipe_memberships.
+    """
+    raw = '|'.join((
+        request.get_host(),
+        request.accepted_renderer.format,
+        RecipeResponseCache.normalize_query(request),
+        membership_part(request.user, memberships),
+        *map(str, parts),
+    ))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def conditional_response(request, etag, last_modified):
+    """304 Not Modified, если у клиента актуальная версия, иначе None.
+
+    Last-Modified учитывается только для анонимов: смена избранного
+    или корзины не меняет updated_at, но меняет ответ.
+    """
+    if request.user.is_authenticated:
+        last_modified = None
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+
+
+def set_validators(request, response, etag, last_modified):
+    """ETag и Last-Modified для ответа 200 или 304."""
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    if last_modified is not None and not request.user.is_authenticated:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
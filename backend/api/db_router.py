@@ -0,0 +1,109 @@
+"""Чтение с реплик базы данных.
+
+Реплики перечислены в settings.DATABASE_REPLICAS. ReplicaMiddleware
+выбирает одну реплику на весь безопасный запрос (GET, HEAD, OPTIONS),
+ReplicaRouter отправляет на неё чтение, а запись всегда идёт в
+основную базу. Вне запросов (команды, shell, миграции) всё читается
+из основной базы.
+
+Реплика отстаёт от основной базы, поэтому после успешного изменения
+клиент получает cookie, и следующие REPLICA_PIN_SECONDS секунд его
+запросы читают из основной базы: свои избранное, корзина и новый
+рецепт видны сразу. Всё, что кладётся в кэш или индексы в памяти,
+читается из основной базы (блок primary): иначе отставание реплики
+закрепилось бы в них до истечения записи.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Реплика текущего запроса, None — основная база.
+current_replica = ContextVar('current_replica', default=None)
+
+
+@contextmanager
+def primary():
+    """Читать из основной базы внутри блока."""
+    token = current_replica.set(None)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Чтение с реплики запроса, запись и миграции — в основную базу."""
+
+    def db_for_read(self, model, **hints):
+        return current_replica.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Во всех базах одни и те же данные.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему на реплики переносит репликация.
+        return db == PRIMARY
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def choose_replica(request):
+        if (
+            not settings.DATABASE_REPLICAS
+            or request.method not in SAFE_METHODS
+            or PIN_COOKIE in request.COOKIES
+        ):
+            return None
+        # Одна реплика на запрос: у разных реплик разное отставание.
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    @staticmethod
+    def pin(request, response):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -1,11 +1,14 @@
 from http import HTTPStatus
 
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from recipes.models import Recipe
 from rest_framework import mixins, viewsets
 from rest_framework.response import Response
 
-from .serializers import RecipeSerializer
+from .memberships import recipe_memberships
+from .serializers import RecipeIdsSerializer, RecipeSerializer
+from .services import lock_users
 
 
 class CreateDestroyViewSet(mixins.CreateModelMixin,
@@ -15,14 +18,23 @@ class CreateDestroyViewSet(mixins.CreateModelMixin,
 
 
 class RelationBaseViewSet(CreateDestroyViewSet):
+    membership = None
+    # Добавлять под блокировкой пользователя, как и RelationBulkViewSet.
+    lock_user = False
+
     def get_queryset(self):
         return self.model.objects.filter(user=self.request.user)
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         recipe = get_object_or_404(
             Recipe,
             id=self.kwargs.get('recipe_id')
         )
+        # Пакетное добавление не должно решить, что добавило рецепт,
+        # который параллельно добавлен здесь.
+        if self.lock_user:
+            lock_users((request.user.id,))
         o, created = self.model.objects.get_or_create(
             user=self.request.user,
             recipe=recipe)
@@ -31,9 +43,11 @@ class RelationBaseViewSet(CreateDestroyViewSet):
                 'This recipe has already been added.',
                 status=HTTPStatus.BAD_REQUEST
             )
+        recipe_memberships.invalidate(request.user.id, self.membership)
         serializer = RecipeSerializer(recipe, many=False)
         return Response(data=serializer.data, status=HTTPStatus.CREATED)
 
+    @transaction.atomic
     def delete(self, request, *args, **kwargs):
         recipe = get_object_or_404(
             Recipe,
@@ -44,4 +58,103 @@ class RelationBaseViewSet(CreateDestroyViewSet):
             user=request.user,
             recipe=recipe
         ).delete()
+        recipe_memberships.invalidate(request.user.id, self.membership)
         return Response(status=HTTPStatus.NO_CONTENT)
+
+
+class RelationBulkViewSet(viewsets.GenericViewSet):
+    """Пакетные операции со списком рецептов пользователя.
+
+    add и remove принимают {"recipes": [id, ...]}, clear очищает список
+    одним DELETE. В ответе состояние списка после операции.
+
+    Строки пишутся и удаляются пакетом, без post_save и post_delete:
+    то, что для одной записи делают сигналы, делают after_add,
+    after_remove и before_clear. lock_user включает блокировку
+    пользователя, она нужна, если они что-то прибавляют или вычитают.
+    """
+    membership = None
+    lock_user = False
+    serializer_class = RecipeIdsSerializer
+
+    def get_queryset(self):
+        return self.model.objects.filter(user=self.request.user)
+
+    def after_add(self, recipe_ids):
+        """Вызывается после добавления рецептов в список."""
+
+    def after_remove(self, recipe_ids):
+        """Вызывается после удаления рецептов из списка."""
+
+    def before_clear(self):
+        """Вызывается перед очисткой списка."""
+
+    @staticmethod
+    def delete_rows(queryset):
+        """Удаляет строки одним DELETE, без сигналов и каскадов.
+
+        QuerySet.delete() при подключённых post_delete читает строки и
+        шлёт сигнал на каждую.
+        """
+        return queryset._raw_delete(queryset.db)
+
+    def lock(self, request):
+        if self.lock_user:
+            lock_users((request.user.id,))
+
+    def get_recipe_ids(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    def get_state(self, request, changed):
+        recipe_memberships.invalidate(request.user.id, self.membership)
+        recipes = recipe_memberships.get(
+            request.user, (self.membership,)
+        )[self.membership]
+        return Response({'changed': changed, 'recipes': sorted(recipes)})
+
+    @transaction.atomic
+    def add(self, request, *args, **kwargs):
+        recipe_ids = self.get_recipe_ids(request)
+        # Под блокировкой пользователя никто не добавит рецепт между
+        # чтением списка и INSERT: ignore_conflicts молча пропустил бы
+        # его, а after_add учёл бы второй раз.
+        self.lock(request)
+        added = recipe_ids - set(
+            self.get_queryset().filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True)
+        )
+        self.model.objects.bulk_create(
+            (self.model(user=request.user, recipe_id=recipe_id)
+             for recipe_id in added),
+            ignore_conflicts=True,
+        )
+        if added:
+            self.after_add(added)
+        return self.get_state(request, len(added))
+
+    @transaction.atomic
+    def remove(self, request, *args, **kwargs):
+        recipe_ids = self.get_recipe_ids(request)
+        # Иначе два параллельных удаления вычли бы рецепт дважды.
+        self.lock(request)
+        removed = set(
+            self.get_queryset().filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True)
+        )
+        if removed:
+            self.delete_rows(
+                self.get_queryset().filter(recipe_id__in=removed)
+            )
+            self.after_remove(removed)
+        return self.get_state(request, len(removed))
+
+    @transaction.atomic
+    def clear(self, request, *args, **kwargs):
+        self.lock(request)
+        self.before_clear()
+        removed = self.delete_rows(self.get_queryset())
+        return self.get_state(request, removed)
@@ -1,5 +1,10 @@
+from django.db.models import F
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, PurchasingList, Recipe
+from recipes.models import Ingredient, Recipe
+from recipes.search import search_recipes
+
+from .memberships import recipe_memberships
+from .tag_bits import tag_bits
 
 
 class IngredientFilter(FilterSet):
@@ -14,8 +19,9 @@ class RecipeFilter(FilterSet):
     author = filters.CharFilter(
         field_name='author__id',
     )
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_bits.choices,
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
@@ -23,23 +29,36 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='filter_search',
+    )
+
+    def filter_tags(self, queryset, name, value):
+        # Рецепт подходит, если у него есть хотя бы один из тегов.
+        return queryset.alias(
+            matched_tags=F('tags_mask').bitand(tag_bits.mask(value))
+        ).filter(matched_tags__gt=0)
+
+    def filter_search(self, queryset, name, value):
+        # Лучшие совпадения сверху. Keyset-пагинация (?cursor=)
+        # сортирует найденное по дате.
+        return search_recipes(queryset, value)
 
     def get_is_favorited(self, queryset, name, value):
-        if not value:
-            return queryset
-        user = self.request.user
-        return queryset.filter(favorites__user=user)
+        return self.filter_by_membership(queryset, 'favorites', value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_by_membership(queryset, 'cart', value)
+
+    def filter_by_membership(self, queryset, kind, value):
         if not value:
             return queryset
-        carts = PurchasingList.objects.filter(user=self.request.user)
         return queryset.filter(
-            pk__in=(cart.recipe.pk for cart in carts)
+            pk__in=recipe_memberships.get(self.request.user)[kind]
         )
 
     class Meta:
         model = Recipe
         fields = (
-            'author', 'tags', 'is_favorited', 'is_in_shopping_cart'
+            'author', 'tags', 'is_favorited', 'is_in_shopping_cart', 'search'
         )
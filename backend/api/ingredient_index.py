@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from recipes.models import Ingredient
+
+from .db_router import primary
+
+logger = logging.getLogger(__name__)
+
+# Больше любого символа, который может встретиться в названии.
+_PREFIX_END = '\U0010ffff'
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для поиска по префиксу.
+
+    Хранит отсортированный массив названий в casefold и отвечает на
+    запросы через bisect, не обращаясь к базе. Индекс собирается при
+    первом запросе (или при старте воркера через warm) и пересобирается,
+    когда каталог меняется или истекает ttl секунд.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = ([], [])
+        self._built_at = None
+
+    def build(self):
+        rows = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = [row[0] for row in rows]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+        self._index = (keys, items)
+        self._built_at = time.monotonic()
+
+    def warm(self):
+        """Собирает индекс, не падая, если база ещё недоступна."""
+        try:
+            self.build()
+        except DatabaseError:
+            logger.warning('Ingredient index was not built', exc_info=True)
+
+    def invalidate(self):
+        self._built_at = None
+
+    def is_stale(self):
+        return self._built_at is None or (
+            self.ttl is not None
+            and time.monotonic() - self._built_at > self.ttl
+        )
+
+    def refresh(self):
+        if self.is_stale():
+            with self._lock, primary():
+                if self.is_stale():
+                    self.build()
+
+    def search(self, prefix, limit=None):
+        self.refresh()
+        return self._lookup(prefix, limit)
+
+    async def asearch(self, prefix, limit=None):
+        """search из асинхронного кода: база читается только в потоке."""
+        if self.is_stale():
+            await sync_to_async(self.refresh)()
+        return self._lookup(prefix, limit)
+
+    def _lookup(self, prefix, limit):
+        keys, items = self._index
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + _PREFIX_END, start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return items[start:end]
+
+    def __len__(self):
+        return len(self._index[0])
+
+
+ingredient_index = IngredientIndex(ttl=settings.INGREDIENT_INDEX_TTL)
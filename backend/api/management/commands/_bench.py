@@ -0,0 +1,83 @@
+"""Helpers shared by the bench_* management commands."""
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Ingredient, IngredientsRecipe, Recipe, Tag,
+                            TagsRecipe, get_tags_mask)
+
+User = get_user_model()
+
+BENCH_IMAGE = 'foodgram/images/bench.png'
+
+
+def create_users(count, prefix='bench_user'):
+    return User.objects.bulk_create(
+        User(
+            username=f'{prefix}_{i}',
+            email=f'{prefix}_{i}@example.com',
+            first_name='Bench',
+            last_name=str(i),
+        )
+        for i in range(count)
+    )
+
+
+def create_catalog(tags=3, ingredients=50):
+    tag_objects = Tag.objects.bulk_create(
+        Tag(
+            name=f'bench tag {i}',
+            color=f'#{i:06x}',
+            slug=f'bench-tag-{i}',
+        )
+        for i in range(tags)
+    )
+    ingredient_objects = Ingredient.objects.bulk_create(
+        Ingredient(name=f'bench ingredient {i}', measurement_unit='г')
+        for i in range(ingredients)
+    )
+    return tag_objects, ingredient_objects
+
+
+def recipe_tags(i, tags):
+    return [tags[(i + j) % len(tags)] for j in range(min(2, len(tags)))]
+
+
+def create_recipes(authors, count, tags, ingredients,
+                   ingredients_per_recipe=8):
+    recipes = Recipe.objects.bulk_create(
+        Recipe(
+            name=f'bench recipe {i}',
+            description='bench',
+            author=authors[i % len(authors)],
+            image=BENCH_IMAGE,
+            cooking_time=i % 120 + 1,
+            tags_mask=get_tags_mask(recipe_tags(i, tags)),
+        )
+        for i in range(count)
+    )
+    TagsRecipe.objects.bulk_create(
+        TagsRecipe(recipe=recipe, tag=tag)
+        for i, recipe in enumerate(recipes)
+        for tag in recipe_tags(i, tags)
+    )
+    IngredientsRecipe.objects.bulk_create(
+        IngredientsRecipe(
+            recipe=recipe,
+            ingredient=ingredients[(i + j) % len(ingredients)],
+            amount=j + 1,
+        )
+        for i, recipe in enumerate(recipes)
+        for j in range(ingredients_per_recipe)
+    )
+    return recipes
+
+
+def measure(function, *args, **kwargs):
+    """Return (result, number of queries, elapsed ms)."""
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+    return result, len(context.captured_queries), elapsed
@@ -0,0 +1,329 @@
+import json
+import random
+import statistics
+
+from api.pantry import pantry_index
+from api.services import rebuild_shopping_lists
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings, setup_test_environment
+from recipes.models import Favorite, PurchasingList
+from recipes.search import rebuild_index
+from recipes.similar import rebuild_similar
+from rest_framework.test import APIClient
+from users.models import Follow
+
+from ._bench import create_catalog, create_recipes, create_users, measure
+
+# A 1x1 PNG for the recipes created by the bulk endpoint.
+BENCH_IMAGE_DATA = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+BULK_RECIPES = 5
+
+COLD_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench_endpoints',
+    }
+}
+
+# (name, client, method, url, parameters, expected status, budget).
+# Parameters are the query of a GET and the JSON body of other methods.
+# URL and parameters are formatted with the ids of the seeded data; a
+# parameter that is only a placeholder takes the value as is, so it can
+# be a list. A POST is followed by the DELETE that undoes it, so every
+# repetition starts from the same state; only recipes from the bulk
+# endpoint pile up. Budgets are for a cache emptied before every
+# request.
+ENDPOINTS = (
+    ('recipes', 'anonymous', 'get', '/api/recipes/', {}, 200, 5),
+    ('recipes', 'user', 'get', '/api/recipes/', {}, 200, 8),
+    ('recipes limit=50', 'user', 'get', '/api/recipes/',
+     {'limit': 50}, 200, 8),
+    ('recipes page=3', 'user', 'get', '/api/recipes/',
+     {'page': 3}, 200, 8),
+    ('recipes cursor', 'user', 'get', '/api/recipes/',
+     {'cursor': '', 'limit': 20}, 200, 7),
+    ('recipes tags', 'user', 'get', '/api/recipes/',
+     {'tags': ['{tag}', '{other_tag}']}, 200, 9),
+    ('recipes author', 'user', 'get', '/api/recipes/',
+     {'author': '{author}'}, 200, 8),
+    ('recipes search', 'anonymous', 'get', '/api/recipes/',
+     {'search': 'bench recipe'}, 200, 5),
+    ('recipes search', 'user', 'get', '/api/recipes/',
+     {'search': 'bench recipe'}, 200, 8),
+    ('recipes bulk', 'user', 'post', '/api/recipes/bulk/',
+     '{new_recipes}', 201, 9),
+    ('recipes is_favorited', 'user', 'get', '/api/recipes/',
+     {'is_favorited': 1}, 200, 8),
+    ('recipes is_in_shopping_cart', 'user', 'get', '/api/recipes/',
+     {'is_in_shopping_cart': 1}, 200, 8),
+    ('recipe', 'anonymous', 'get', '/api/recipes/{recipe}/', {}, 200, 4),
+    ('recipe', 'user', 'get', '/api/recipes/{recipe}/', {}, 200, 7),
+    ('similar', 'anonymous', 'get', '/api/recipes/{recipe}/similar/',
+     {}, 200, 2),
+    ('cook', 'anonymous', 'get', '/api/recipes/cook/',
+     {'ingredients': '{pantry}'}, 200, 2),
+    ('favorite add', 'user', 'post', '/api/recipes/{free_recipe}/favorite/',
+     {}, 201, 8),
+    ('favorite remove', 'user', 'delete',
+     '/api/recipes/{free_recipe}/favorite/', {}, 204, 6),
+    ('favorite bulk add', 'user', 'post', '/api/recipes/favorite/',
+     {'recipes': '{free_recipes}'}, 200, 6),
+    ('favorite bulk remove', 'user', 'post',
+     '/api/recipes/favorite/remove/', {'recipes': '{free_recipes}'},
+     200, 6),
+    ('favorite clear', 'user', 'delete', '/api/recipes/favorite/', {},
+     200, 4),
+    ('favorite bulk restore', 'user', 'post', '/api/recipes/favorite/',
+     {'recipes': '{favorites}'}, 200, 6),
+    ('cart add', 'user', 'post', '/api/recipes/{free_recipe}/shopping_cart/',
+     {}, 201, 13),
+    ('cart remove', 'user', 'delete',
+     '/api/recipes/{free_recipe}/shopping_cart/', {}, 204, 11),
+    ('cart bulk add', 'user', 'post', '/api/recipes/shopping_cart/',
+     {'recipes': '{free_recipes}'}, 200, 11),
+    ('cart bulk remove', 'user', 'post', '/api/recipes/shopping_cart/remove/',
+     {'recipes': '{free_recipes}'}, 200, 11),
+    # Does not grow with the cart: no signal for every deleted row.
+    ('cart clear', 'user', 'delete', '/api/recipes/shopping_cart/', {},
+     200, 6),
+    ('cart bulk restore', 'user', 'post', '/api/recipes/shopping_cart/',
+     {'recipes': '{cart}'}, 200, 11),
+    ('download_shopping_cart', 'user', 'get',
+     '/api/recipes/download_shopping_cart/', {}, 200, 1),
+    ('download_shopping_cart csv', 'user', 'get',
+     '/api/recipes/download_shopping_cart/', {'format': 'csv'}, 200, 1),
+    ('subscriptions', 'user', 'get', '/api/users/subscriptions/',
+     {'recipes_limit': 3}, 200, 3),
+    ('subscribe', 'user', 'post', '/api/users/{free_author}/subscribe/',
+     {}, 201, 6),
+    ('unsubscribe', 'user', 'delete', '/api/users/{free_author}/subscribe/',
+     {}, 204, 3),
+    ('users', 'anonymous', 'get', '/api/users/', {}, 200, 2),
+    ('users', 'user', 'get', '/api/users/', {}, 200, 3),
+    ('user', 'user', 'get', '/api/users/{author}/', {}, 200, 2),
+    ('me', 'user', 'get', '/api/users/me/', {}, 200, 1),
+    ('tags', 'anonymous', 'get', '/api/tags/', {}, 200, 1),
+    ('tag', 'anonymous', 'get', '/api/tags/{tag_id}/', {}, 200, 1),
+    ('ingredients', 'anonymous', 'get', '/api/ingredients/', {}, 200, 1),
+    ('ingredients search', 'anonymous', 'get', '/api/ingredients/',
+     {'name': 'bench ingredient 1'}, 200, 0),
+    ('ingredient', 'anonymous', 'get', '/api/ingredients/{ingredient}/',
+     {}, 200, 1),
+)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def format_value(value, context):
+    if isinstance(value, str) and value.startswith('{') and (
+            value[1:-1] in context):
+        return context[value[1:-1]]
+    if isinstance(value, dict):
+        return {
+            key: format_value(item, context) for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [format_value(item, context) for item in value]
+    return value.format(**context) if isinstance(value, str) else value
+
+
+class Command(BaseCommand):
+    """Query count and latency of every API endpoint.
+
+    Seeds a dataset in a rolled back transaction, requests each endpoint
+    of api/urls.py --repeat times in process and reports the query
+    count with p50 and p95 latency. Fails when an endpoint answers with
+    an unexpected status, needs more queries than its budget in
+    ENDPOINTS (for example after a serializer reintroduces an N+1) or,
+    with --max-p95, is slower than that.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Measured requests per endpoint, after one warm-up.',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=200,
+            help='How many recipes to seed.',
+        )
+        parser.add_argument(
+            '--only', default=None,
+            help='Measure only endpoints whose name contains this text.',
+        )
+        parser.add_argument(
+            '--max-p95', type=float, default=None,
+            help='Latency budget in ms for p95 of every endpoint.',
+        )
+        parser.add_argument(
+            '--cache', action='store_true',
+            help='Keep the configured cache and do not clear it.',
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='Write the results to this JSON file.',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if options['only'] is None or options['only'] in endpoint[0]
+        ]
+        self.cold = not options['cache']
+        caches = {'CACHES': COLD_CACHE} if self.cold else {}
+        # Replicas never see the rolled back seed data.
+        with override_settings(DATABASE_REPLICAS=[], **caches), \
+                transaction.atomic():
+            results = self.run(endpoints, options['repeat'],
+                               options['recipes'])
+            transaction.set_rollback(True)
+
+        failures = self.report(results, options['max_p95'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All endpoints within budget'))
+
+    def seed(self, recipes_count):
+        random.seed(0)
+        authors = create_users(20, 'bench_author')
+        reader, = create_users(1, 'bench_reader')
+        tags, ingredients = create_catalog()
+        recipes = create_recipes(authors, recipes_count, tags, ingredients)
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in authors[1:]
+        )
+        chosen = random.sample(recipes[1:], min(40, len(recipes) - 1))
+        Favorite.objects.bulk_create(
+            Favorite(user=reader, recipe=recipe) for recipe in chosen
+        )
+        cart = chosen[:20]
+        PurchasingList.objects.bulk_create(
+            PurchasingList(user=reader, recipe=recipe) for recipe in cart
+        )
+        rebuild_shopping_lists([reader.id])
+        # Another reader, so that the favorites have co-favorites.
+        other, = create_users(1, 'bench_other')
+        Favorite.objects.bulk_create(
+            Favorite(user=other, recipe=recipe)
+            for recipe in [recipes[-1], *chosen[:10]]
+        )
+        rebuild_similar()
+        # bulk_create does not fill the SQLite search table.
+        rebuild_index()
+        pantry_index.invalidate()
+        taken = {recipe.id for recipe in chosen}
+        free_recipes = [
+            recipe.id for recipe in recipes[1:] if recipe.id not in taken
+        ][:5]
+        context = {
+            'recipe': recipes[-1].id,
+            'free_recipe': recipes[0].id,
+            'author': authors[1].id,
+            'free_author': authors[0].id,
+            'tag': tags[0].slug,
+            'other_tag': tags[1].slug,
+            'tag_id': tags[0].id,
+            'ingredient': ingredients[0].id,
+            'cart': [recipe.id for recipe in cart],
+            'favorites': [recipe.id for recipe in chosen],
+            'free_recipes': free_recipes,
+            'pantry': ','.join(
+                str(ingredient.id) for ingredient in ingredients[:10]
+            ),
+            'new_recipes': [
+                {
+                    'name': f'bench bulk recipe {i}',
+                    'text': 'bench',
+                    'cooking_time': 10,
+                    'image': BENCH_IMAGE_DATA,
+                    'tags': [tags[0].id],
+                    'ingredients': [
+                        {'id': ingredient.id, 'amount': 1}
+                        for ingredient in ingredients[i:i + 5]
+                    ],
+                }
+                for i in range(BULK_RECIPES)
+            ],
+        }
+        return reader, context
+
+    def request(self, client, method, url, params):
+        if self.cold:
+            cache.clear()
+        if method == 'get':
+            response = client.get(url, params)
+        else:
+            response = getattr(client, method)(url, params, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def run(self, endpoints, repeat, recipes_count):
+        reader, context = self.seed(recipes_count)
+        clients = {'anonymous': APIClient(), 'user': APIClient()}
+        clients['user'].force_authenticate(reader)
+
+        samples = {index: [] for index in range(len(endpoints))}
+        for iteration in range(repeat + 1):
+            for index, endpoint in enumerate(endpoints):
+                name, client, method, url, params, status, _ = endpoint
+                response, queries, elapsed = measure(
+                    self.request, clients[client], method,
+                    format_value(url, context),
+                    format_value(params, context),
+                )
+                if response.status_code != status:
+                    raise CommandError(
+                        f'{method.upper()} {name} ({client}) returned '
+                        f'{response.status_code} instead of {status}'
+                    )
+                if iteration:
+                    samples[index].append((queries, elapsed))
+
+        results = []
+        for index, (name, client, method, *_, budget) in enumerate(endpoints):
+            queries = [sample[0] for sample in samples[index]]
+            elapsed = [sample[1] for sample in samples[index]]
+            results.append({
+                'name': name,
+                'client': client,
+                'method': method.upper(),
+                'queries': max(queries),
+                'budget': budget,
+                'p50_ms': round(statistics.median(elapsed), 3),
+                'p95_ms': round(percentile(elapsed, 0.95), 3),
+            })
+        return results
+
+    def report(self, results, max_p95):
+        failures = []
+        for result in results:
+            title = f'{result["method"]} {result["name"]} ({result["client"]})'
+            self.stdout.write(
+                f'{title:<50} {result["queries"]:>3}/{result["budget"]:<3}'
+                f' queries  p50 {result["p50_ms"]:8.2f} ms'
+                f'  p95 {result["p95_ms"]:8.2f} ms'
+            )
+            if result['queries'] > result['budget']:
+                failures.append(
+                    f'{title}: {result["queries"]} queries, '
+                    f'budget {result["budget"]}'
+                )
+            if max_p95 is not None and result['p95_ms'] > max_p95:
+                failures.append(
+                    f'{title}: p95 {result["p95_ms"]} ms, '
+                    f'budget {max_p95} ms'
+                )
+        return failures
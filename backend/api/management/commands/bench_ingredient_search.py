@@ -0,0 +1,75 @@
+import csv
+import time
+
+from api.filters import IngredientFilter
+from api.ingredient_index import IngredientIndex
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.models import Ingredient
+
+PREFIXES = ('а', 'мо', 'сах', 'кар', 'пер', 'сливочн', 'я', 'x')
+
+
+class Command(BaseCommand):
+    """Compare ingredient prefix search through the ORM and the index.
+
+    Uses the current catalog, or loads data/ingredients.csv inside
+    a transaction that is rolled back when the catalog is empty.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='How many times every prefix is searched.',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Result limit passed to the index.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not Ingredient.objects.exists():
+                self.load_catalog()
+            self.run(options['repeat'], options['limit'])
+            transaction.set_rollback(True)
+
+    def load_catalog(self):
+        with open(
+                f'{settings.BASE_DIR}/data/ingredients.csv',
+                'r', encoding='utf-8',
+        ) as table:
+            Ingredient.objects.bulk_create(
+                Ingredient(**data) for data in csv.DictReader(table)
+            )
+
+    def run(self, repeat, limit):
+        index = IngredientIndex()
+        start = time.perf_counter()
+        index.build()
+        build_time = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f'index of {len(index)} ingredients built in {build_time:.2f} ms'
+        )
+
+        queryset = Ingredient.objects.all()
+        for prefix in PREFIXES:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                orm_result = list(IngredientFilter(
+                    {'name': prefix}, queryset=queryset
+                ).qs.values('id', 'name', 'measurement_unit'))
+            orm_time = (time.perf_counter() - start) / repeat * 1e6
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                index_result = index.search(prefix, limit)
+            index_time = (time.perf_counter() - start) / repeat * 1e6
+
+            self.stdout.write(
+                f'{prefix!r:>12}: orm {orm_time:9.1f} us '
+                f'({len(orm_result)} rows), '
+                f'index {index_time:7.1f} us ({len(index_result)} rows), '
+                f'x{orm_time / index_time:.0f}'
+            )
@@ -0,0 +1,240 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from api.pantry import PantryIndex
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+from recipes.models import Ingredient, IngredientsRecipe, Recipe
+
+from ._bench import BENCH_IMAGE, create_users
+
+PANTRY_SIZES = (3, 10, 30)
+PAGE_SIZE = 6
+# Recipes compared with the SQL ranking for every pantry size.
+SQL_CHECKS = 3
+
+
+class Command(BaseCommand):
+    """Measure /api/recipes/cook/ matching on a large recipe table.
+
+    Creates --recipes recipes with 3 to 15 ingredients each in a rolled
+    back transaction; ingredients are picked with Zipf frequencies, so
+    salt and onions are in most recipes and a rare spice in a few. Times
+    the full build of the pantry index, matching pantries of several
+    sizes against it and the same ranking done by the database, and
+    checks that both rank the first page the same. Then changes
+    --changed recipes, catches a separately built index up with the
+    database like another worker would and checks that it matches a
+    fresh build.
+    Counting reads the recipe arrays of every pantry ingredient, so a
+    match takes time in proportion to how common they are.
+    Fails when the 95th percentile of a match is over --max-ms.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=200_000,
+            help='Number of recipes to match.',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Number of ingredients in the catalog.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Pantries matched for every pantry size.',
+        )
+        parser.add_argument(
+            '--changed', type=int, default=100,
+            help='Recipes changed before the incremental sync.',
+        )
+        parser.add_argument(
+            '--max-ms', type=float, default=20.0,
+            help='Budget for the 95th percentile of a match.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10_000,
+            help='Recipes per INSERT when seeding.',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(0)
+        with transaction.atomic():
+            self.seed(
+                options['recipes'], options['ingredients'],
+                options['batch_size'],
+            )
+            slow = self.run(options['repeat'], options['max_ms'])
+            self.run_sync(options['changed'])
+            transaction.set_rollback(True)
+        if slow:
+            raise CommandError(
+                f'Matches over {options["max_ms"]} ms for pantries of '
+                + ', '.join(map(str, slow)) + ' ingredients'
+            )
+        self.stdout.write(self.style.SUCCESS('Matching is within budget'))
+
+    def seed(self, count, ingredients, batch_size):
+        self.ingredient_ids = [
+            ingredient.id for ingredient in Ingredient.objects.bulk_create(
+                Ingredient(name=f'bench ingredient {i}', measurement_unit='г')
+                for i in range(ingredients)
+            )
+        ]
+        self.weights = list(accumulate(
+            1 / rank for rank in range(1, ingredients + 1)
+        ))
+        authors = create_users(10, 'bench_author')
+
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'bench recipe {i}',
+                    description='bench',
+                    author=authors[i % len(authors)],
+                    image=BENCH_IMAGE,
+                    cooking_time=i % 120 + 1,
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            )
+            IngredientsRecipe.objects.bulk_create(
+                row
+                for recipe in recipes
+                for row in self.ingredient_rows(recipe.id)
+            )
+        # Seeded long ago: only the changes below are new to a sync.
+        Recipe.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        with connection.cursor() as cursor:
+            for model in (Recipe, IngredientsRecipe):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        self.stdout.write(
+            f'Seeded {count} recipes in {time.perf_counter() - start:.1f} s'
+        )
+
+    def ingredient_rows(self, recipe_id):
+        ingredient_ids = set(self.rng.choices(
+            self.ingredient_ids, cum_weights=self.weights,
+            k=self.rng.randint(3, 15),
+        ))
+        return [
+            IngredientsRecipe(
+                recipe_id=recipe_id, ingredient_id=ingredient_id, amount=1
+            )
+            for ingredient_id in ingredient_ids
+        ]
+
+    def pantry(self, size):
+        return list(set(self.rng.choices(
+            self.ingredient_ids, cum_weights=self.weights, k=size
+        )))
+
+    def run(self, repeat, max_ms):
+        index = PantryIndex()
+        start = time.perf_counter()
+        index.build()
+        self.stdout.write(
+            f'Index of {len(index)} recipes built in '
+            f'{(time.perf_counter() - start) * 1000:.0f} ms'
+        )
+
+        slow = []
+        for size in PANTRY_SIZES:
+            pantries = [self.pantry(size) for _ in range(repeat)]
+            matches = []
+            elapsed = []
+            for pantry in pantries:
+                start = time.perf_counter()
+                match = index.match(pantry)
+                match[:PAGE_SIZE], match.missing_one()[:PAGE_SIZE]
+                elapsed.append((time.perf_counter() - start) * 1000)
+                matches.append(len(match))
+            index_p50, index_p95 = self.percentiles(elapsed)
+
+            elapsed = []
+            for pantry in pantries[:SQL_CHECKS]:
+                match = index.match(pantry)
+                start = time.perf_counter()
+                page = sql_match(pantry, PAGE_SIZE)
+                elapsed.append((time.perf_counter() - start) * 1000)
+                expected = match[:PAGE_SIZE]
+                if page != expected:
+                    raise CommandError(
+                        f'Index and SQL rank {pantry} differently: '
+                        f'{expected} != {page}'
+                    )
+
+            self.stdout.write(
+                f'{size:>3} ingredients: {statistics.median(matches):>8.0f} '
+                f'matches  index p50 {index_p50:6.2f} ms p95 '
+                f'{index_p95:6.2f} ms  sql {statistics.median(elapsed):8.1f}'
+                ' ms'
+            )
+            if index_p95 > max_ms:
+                slow.append(size)
+        return slow
+
+    def run_sync(self, changed):
+        index = PantryIndex()
+        index.build()
+        recipe_ids = self.rng.sample(
+            list(Recipe.objects.values_list('id', flat=True)), changed
+        )
+        IngredientsRecipe.objects.filter(recipe_id__in=recipe_ids).delete()
+        IngredientsRecipe.objects.bulk_create(
+            row
+            for recipe_id in recipe_ids
+            for row in self.ingredient_rows(recipe_id)
+        )
+        Recipe.objects.touch(pk__in=recipe_ids)
+
+        index.mark_changed()
+        start = time.perf_counter()
+        index.refresh()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        fresh = PantryIndex()
+        fresh.build()
+        for size in PANTRY_SIZES:
+            pantry = self.pantry(size)
+            synced, built = index.match(pantry), fresh.match(pantry)
+            if synced[:] != built[:]:
+                raise CommandError(
+                    f'Synced index differs from a fresh build for {pantry}'
+                )
+        self.stdout.write(
+            f'Synced {changed} changed recipes in {elapsed:.1f} ms'
+        )
+
+    @staticmethod
+    def percentiles(elapsed):
+        if len(elapsed) < 2:
+            return elapsed[0], elapsed[0]
+        return (
+            statistics.median(elapsed),
+            statistics.quantiles(elapsed, n=20)[-1],
+        )
+
+
+def sql_match(ingredient_ids, limit):
+    """The index ranking as one GROUP BY query: [(id, covered, total)]."""
+    return list(Recipe.objects.order_by().annotate(
+        covered=Count(
+            'ingredients_list',
+            filter=Q(ingredients_list__ingredient_id__in=ingredient_ids),
+        ),
+        total=Count('ingredients_list'),
+    ).filter(covered__gt=0).alias(
+        share=ExpressionWrapper(
+            Cast('covered', FloatField()) / F('total'),
+            output_field=FloatField(),
+        ),
+    ).order_by('-share', '-covered', '-id').values_list(
+        'id', 'covered', 'total'
+    )[:limit])
@@ -0,0 +1,95 @@
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings, setup_test_environment
+from rest_framework.test import APIClient
+from users.models import Follow
+
+from ._bench import create_catalog, create_recipes, create_users, measure
+
+PAGE_SIZES = (1, 6, 20, 50)
+# Token, version of the list, COUNT(*), recipes, tags, ingredients
+# and, with an empty cache, the reader's favorites, cart and
+# subscriptions.
+QUERY_BUDGET = 9
+COLD_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench_recipe_list',
+    }
+}
+
+
+class Command(BaseCommand):
+    """Enforce the query budget of the recipe list.
+
+    Renders /api/recipes/ for several page sizes, anonymously and as
+    a logged in user, on data created in a rolled back transaction.
+    The cache is emptied before every request, so each one does the
+    full work.
+    Fails when a page needs more than QUERY_BUDGET queries or when the
+    count grows with the page size.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=PAGE_SIZES,
+            help='Page sizes (?limit=) to render.',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        sizes = sorted(options['sizes'])
+        # Replicas never see the rolled back seed data.
+        with override_settings(CACHES=COLD_CACHE, DATABASE_REPLICAS=[]), \
+                transaction.atomic():
+            results = self.run(sizes)
+            transaction.set_rollback(True)
+
+        failed = False
+        for client_name in ('anonymous', 'user'):
+            counts = set()
+            for size, name, queries, elapsed in results:
+                if name != client_name:
+                    continue
+                counts.add(queries)
+                self.stdout.write(
+                    f'{name:>9}, limit={size:<4}: '
+                    f'{queries} queries, {elapsed:.2f} ms'
+                )
+                if queries > QUERY_BUDGET:
+                    failed = True
+            if len(counts) != 1:
+                failed = True
+        if failed:
+            raise CommandError(
+                f'Recipe list is over the budget of {QUERY_BUDGET} queries '
+                'or its query count depends on the page size.'
+            )
+        self.stdout.write(self.style.SUCCESS('Recipe list is within budget'))
+
+    def run(self, sizes):
+        authors = create_users(5, 'bench_author')
+        reader, = create_users(1, 'bench_reader')
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in authors[::2]
+        )
+        tags, ingredients = create_catalog()
+        create_recipes(authors, max(sizes), tags, ingredients)
+
+        anonymous = APIClient()
+        user = APIClient()
+        user.force_authenticate(reader)
+        results = []
+        for size in sizes:
+            for name, client in (('anonymous', anonymous), ('user', user)):
+                cache.clear()
+                response, queries, elapsed = measure(
+                    client.get, '/api/recipes/', {'limit': size}
+                )
+                if response.status_code != 200:
+                    raise CommandError(
+                        f'/api/recipes/ returned {response.status_code}'
+                    )
+                results.append((size, name, queries, elapsed))
+        return results
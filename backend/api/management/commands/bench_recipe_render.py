@@ -0,0 +1,142 @@
+import time
+
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings, setup_test_environment
+from recipes.models import Recipe
+from rest_framework.test import APIClient
+from users.models import Follow
+
+from ._bench import create_catalog, create_recipes, create_users
+
+PAGE_SIZES = (6, 20, 50, 100)
+COLD_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench_recipe_render',
+    }
+}
+# Names the JSON encoders escape differently if anything is off.
+TRICKY_NAMES = (
+    'Борщ "по-домашнему"',
+    'tab\tnewline\nback\\slash',
+    'separators \u2028 and \u2029',
+    'control \x01\x1f and del \x7f',
+    'emoji \U0001f372 and </script>',
+)
+
+
+class Command(BaseCommand):
+    """Compare the fast recipe read path with RecipeGetSerializer.
+
+    Seeds recipes in a rolled back transaction and requests the recipe
+    list for every --sizes page size and a recipe detail, anonymously
+    and as a logged in user, with RECIPE_FAST_READS off and on. The
+    cache is emptied before every request, so each one renders.
+    Fails when the two paths return different bytes or, with
+    --min-speedup, when the fast path is not that much faster. The
+    process serves requests one at a time, like a sync gunicorn
+    worker, so requests per second are the throughput of one worker.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=PAGE_SIZES,
+            help='Page sizes (?limit=) to render.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=30,
+            help='Requests per page size and path.',
+        )
+        parser.add_argument(
+            '--min-speedup', type=float, default=None,
+            help='Fail if the fast path is slower than this many times.',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # Replicas never see the rolled back seed data.
+        with override_settings(CACHES=COLD_CACHE, DATABASE_REPLICAS=[]), \
+                transaction.atomic():
+            results = self.run(sorted(options['sizes']), options['repeat'])
+            transaction.set_rollback(True)
+
+        failures = []
+        for name, serializer_rps, fast_rps in results:
+            speedup = fast_rps / serializer_rps
+            self.stdout.write(
+                f'{name:<28} serializer {serializer_rps:8.1f} req/s  '
+                f'fast {fast_rps:8.1f} req/s  x{speedup:.2f}'
+            )
+            if options['min_speedup'] and speedup < options['min_speedup']:
+                failures.append(f'{name}: x{speedup:.2f}')
+        if failures:
+            raise CommandError(
+                f'Fast path is less than x{options["min_speedup"]} faster: '
+                + ', '.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Fast path output is identical to the serializers'
+        ))
+
+    def seed(self, count):
+        authors = create_users(10, 'bench_author')
+        reader, = create_users(1, 'bench_reader')
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in authors[::2]
+        )
+        tags, ingredients = create_catalog()
+        recipes = create_recipes(authors, count, tags, ingredients)
+        for recipe, name in zip(recipes, TRICKY_NAMES):
+            recipe.name = name
+        Recipe.objects.bulk_update(recipes[:len(TRICKY_NAMES)], ('name',))
+        # A deleted author leaves the recipe with author = null.
+        Recipe.objects.filter(pk=recipes[-1].pk).update(author=None)
+        return reader, recipes
+
+    def request(self, client, url, params, fast):
+        with override_settings(RECIPE_FAST_READS=fast):
+            cache.clear()
+            response = client.get(url, params)
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
+        return response.content
+
+    def throughput(self, client, url, params, fast, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            self.request(client, url, params, fast)
+        return repeat / (time.perf_counter() - start)
+
+    def run(self, sizes, repeat):
+        reader, recipes = self.seed(max(sizes))
+        anonymous = APIClient()
+        user = APIClient()
+        user.force_authenticate(reader)
+
+        cases = [
+            (f'list limit={size}', '/api/recipes/', {'limit': size})
+            for size in sizes
+        ]
+        cases += [
+            (f'detail {recipe.pk}', f'/api/recipes/{recipe.pk}/', {})
+            for recipe in (recipes[0], recipes[-1])
+        ]
+        results = []
+        for name, url, params in cases:
+            for client_name, client in (('anonymous', anonymous),
+                                        ('user', user)):
+                title = f'{name} ({client_name})'
+                expected = self.request(client, url, params, fast=False)
+                if self.request(client, url, params, fast=True) != expected:
+                    raise CommandError(
+                        f'{title}: fast path output differs from '
+                        'RecipeGetSerializer'
+                    )
+                results.append((
+                    title,
+                    self.throughput(client, url, params, False, repeat),
+                    self.throughput(client, url, params, True, repeat),
+                ))
+        return results
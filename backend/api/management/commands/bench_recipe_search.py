@@ -0,0 +1,157 @@
+import random
+import statistics
+import time
+from itertools import accumulate, product
+
+from api.recipe_rows import recipe_values
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Recipe
+from recipes.search import rebuild_index, search_recipes
+
+from ._bench import BENCH_IMAGE, create_users
+
+SYLLABLES = ('ба', 'ве', 'ги', 'до', 'жу', 'за', 'ки', 'ло', 'му', 'ни',
+             'по', 'ре', 'си', 'ту', 'фа', 'ха', 'це', 'чи', 'ша', 'юн')
+NAME_WORDS = 3
+DESCRIPTION_WORDS = 15
+# Frequency ranks of the words searched for: 1 is the most common.
+SEARCH_RANKS = (1, 10, 100, 1000)
+PAGE_SIZE = 6
+
+
+class Command(BaseCommand):
+    """Measure ?search= on a large recipe table.
+
+    Creates --recipes recipes in a rolled back transaction. Names and
+    descriptions are made of made-up words with Zipf frequencies, like
+    words of a real language, so the most common word is in almost
+    every recipe and rare ones in a handful. For words of several
+    frequencies, a two-word query and a word that is nowhere, times
+    the first page (ranked recipes with their authors) and the
+    COUNT(*) of the matches.
+    Ranking reads every match, so the time grows with their number.
+    Fails when the 95th percentile of a page query that matches at
+    most --max-matches recipes is over --max-ms; queries for more
+    common words are only reported.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=1_000_000,
+            help='Number of recipes to search.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Runs of every query.',
+        )
+        parser.add_argument(
+            '--max-ms', type=float, default=10.0,
+            help='Budget for the 95th percentile of a page query.',
+        )
+        parser.add_argument(
+            '--max-matches', type=int, default=2000,
+            help='Queries with more matches are not held to --max-ms.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10_000,
+            help='Recipes per INSERT when seeding.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            vocabulary = self.seed(options['recipes'], options['batch_size'])
+            results = self.run(vocabulary, options['repeat'])
+            transaction.set_rollback(True)
+
+        failures = []
+        for text, matches, page, count in results:
+            self.stdout.write(
+                f'{text!r:<24} {matches:>9} matches  '
+                f'page p50 {page[0]:7.2f} ms p95 {page[1]:7.2f} ms  '
+                f'count p50 {count[0]:7.2f} ms p95 {count[1]:7.2f} ms'
+            )
+            if (matches <= options['max_matches']
+                    and page[1] > options['max_ms']):
+                failures.append(text)
+        if failures:
+            raise CommandError(
+                f'Search pages over {options["max_ms"]} ms: '
+                + ', '.join(map(repr, failures))
+            )
+        self.stdout.write(self.style.SUCCESS('Search is within budget'))
+
+    def seed(self, count, batch_size):
+        """Recipes with random texts, returns words by frequency."""
+        vocabulary = [
+            ''.join(syllables)
+            for length in (2, 3)
+            for syllables in product(SYLLABLES, repeat=length)
+        ]
+        rng = random.Random(0)
+        rng.shuffle(vocabulary)
+        weights = list(accumulate(
+            1 / rank for rank in range(1, len(vocabulary) + 1)
+        ))
+        authors = create_users(10, 'bench_author')
+
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            words = rng.choices(
+                vocabulary, cum_weights=weights,
+                k=size * (NAME_WORDS + DESCRIPTION_WORDS),
+            )
+            recipes = []
+            for i in range(size):
+                text = words[i * (NAME_WORDS + DESCRIPTION_WORDS):
+                             (i + 1) * (NAME_WORDS + DESCRIPTION_WORDS)]
+                recipes.append(Recipe(
+                    name=' '.join(text[:NAME_WORDS]).capitalize(),
+                    description=' '.join(text[NAME_WORDS:]),
+                    author=authors[i % len(authors)],
+                    image=BENCH_IMAGE,
+                    cooking_time=i % 120 + 1,
+                ))
+            Recipe.objects.bulk_create(recipes)
+        # bulk_create bypasses the signals that fill the SQLite index.
+        rebuild_index()
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Recipe._meta.db_table}')
+        self.stdout.write(
+            f'Seeded {count} recipes in {time.perf_counter() - start:.1f} s'
+        )
+        return vocabulary
+
+    def run(self, vocabulary, repeat):
+        texts = [vocabulary[rank - 1] for rank in SEARCH_RANKS]
+        texts.append(f'{vocabulary[9]} {vocabulary[99]}')
+        texts.append('несуществующее')
+        results = []
+        for text in texts:
+            queryset = search_recipes(Recipe.objects.all(), text)
+            matches = queryset.count()
+            results.append((
+                text,
+                matches,
+                self.timings(
+                    lambda: list(recipe_values(queryset)[:PAGE_SIZE]), repeat
+                ),
+                self.timings(queryset.count, repeat),
+            ))
+        return results
+
+    @staticmethod
+    def timings(function, repeat):
+        """Median and 95th percentile in ms."""
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            elapsed.append((time.perf_counter() - start) * 1000)
+        if repeat < 2:
+            return elapsed[0], elapsed[0]
+        return (
+            statistics.median(elapsed),
+            statistics.quantiles(elapsed, n=20)[-1],
+        )
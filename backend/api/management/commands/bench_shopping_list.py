@@ -0,0 +1,103 @@
+import time
+
+from api.services import (aggregate_shopping_list, get_shopping_list,
+                          rebuild_shopping_lists)
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Ingredient, IngredientsRecipe, PurchasingList,
+                            Recipe)
+
+User = get_user_model()
+
+CART_SIZES = (1, 10, 100, 1000)
+INGREDIENTS_PER_RECIPE = 8
+PATHS = {
+    'aggregate': lambda user: list(aggregate_shopping_list(user)),
+    'materialized': get_shopping_list,
+}
+
+
+class Command(BaseCommand):
+    """Benchmark shopping list aggregation and the materialized read.
+
+    Builds carts of growing size inside a transaction that is rolled
+    back afterwards and checks that the query count stays constant.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=CART_SIZES,
+            help='Cart sizes (number of recipes) to measure.',
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        with transaction.atomic():
+            results = self.run(sizes)
+            transaction.set_rollback(True)
+
+        for size, name, queries, elapsed in results:
+            self.stdout.write(
+                f'{size:>6} recipes, {name}: '
+                f'{queries} queries, {elapsed:.2f} ms'
+            )
+        for path in PATHS:
+            counts = {
+                queries for _, name, queries, _ in results if name == path
+            }
+            if len(counts) != 1:
+                raise CommandError(
+                    f'Query count of {path} depends on the cart size.'
+                )
+        self.stdout.write(self.style.SUCCESS('Query count is constant'))
+
+    def run(self, sizes):
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'bench ingredient {i}', measurement_unit='г')
+            for i in range(INGREDIENTS_PER_RECIPE * 4)
+        )
+        author = User.objects.create(
+            username='bench_author', email='bench_author@example.com'
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                name=f'bench recipe {i}',
+                description='bench',
+                author=author,
+                image='foodgram/images/bench.png',
+                cooking_time=1,
+            )
+            for i in range(max(sizes))
+        )
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(
+                recipe=recipe,
+                ingredient=ingredients[(i + j) % len(ingredients)],
+                amount=j + 1,
+            )
+            for i, recipe in enumerate(recipes)
+            for j in range(INGREDIENTS_PER_RECIPE)
+        )
+
+        results = []
+        for size in sizes:
+            user = User.objects.create(
+                username=f'bench_user_{size}',
+                email=f'bench_user_{size}@example.com',
+            )
+            PurchasingList.objects.bulk_create(
+                PurchasingList(user=user, recipe=recipe)
+                for recipe in recipes[:size]
+            )
+            rebuild_shopping_lists((user.id,))
+            for name, function in PATHS.items():
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    function(user)
+                    elapsed = (time.perf_counter() - start) * 1000
+                results.append(
+                    (size, name, len(context.captured_queries), elapsed)
+                )
+        return results
@@ -0,0 +1,61 @@
+from api.services import compute_shopping_lists, rebuild_shopping_lists
+from django.core.management import BaseCommand, CommandError
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    """Rebuild or verify materialized shopping lists.
+
+    PurchasingList and IngredientsRecipe are the source of truth,
+    ShoppingListItem is derived from them.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the table with the source of truth.',
+        )
+        parser.add_argument(
+            '--user', dest='user_ids', nargs='+', type=int,
+            help='Limit the command to the given user ids.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per INSERT when rebuilding.',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not options['verify']:
+            rebuild_shopping_lists(user_ids, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Shopping lists rebuilt'))
+            return
+
+        expected = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in compute_shopping_lists(user_ids).iterator()
+        }
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in items.values_list('user_id', 'ingredient_id', 'amount')
+        }
+        mismatched = sorted(
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        )
+        for user_id, ingredient_id in mismatched:
+            self.stdout.write(
+                f'user {user_id}, ingredient {ingredient_id}: '
+                f'expected {expected.get((user_id, ingredient_id))}, '
+                f'stored {actual.get((user_id, ingredient_id))}'
+            )
+        if mismatched:
+            raise CommandError(
+                f'{len(mismatched)} shopping list rows are out of sync.'
+            )
+        self.stdout.write(self.style.SUCCESS('Shopping lists are in sync'))
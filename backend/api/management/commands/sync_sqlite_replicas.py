@@ -0,0 +1,37 @@
+import sqlite3
+
+from api.db_router import PRIMARY
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    """Copy the SQLite primary database into the SQLite replicas.
+
+    SQLite has no replication. To try the replica router locally, point
+    DB_REPLICAS at other SQLite files and run this command whenever the
+    replicas should catch up; in between they lag behind the primary
+    like real replicas do.
+    """
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('DB_REPLICAS is not set.')
+        primary = connections[PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError(
+                'Only SQLite replicas can be synced, the database server '
+                'replicates the others.'
+            )
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'{alias}: {replica.settings_dict["NAME"]}')
+        self.stdout.write(self.style.SUCCESS('Replicas are in sync'))
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from recipes.models import Favorite, PurchasingList
+from users.models import Follow
+
+from .db_router import primary
+
+# Вид связи: (модель, поле с id, который попадает в множество).
+MEMBERSHIP_KINDS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (PurchasingList, 'recipe_id'),
+    'following': (Follow, 'author_id'),
+}
+
+EMPTY_MEMBERSHIPS = {kind: frozenset() for kind in MEMBERSHIP_KINDS}
+
+
+class RecipeMemberships:
+    """Множества id избранного, корзины и подписок пользователя.
+
+    Множество загружается одним запросом и лежит в кэше, пока
+    пользователь не изменит соответствующую связь. Благодаря этому
+    запрос страницы рецептов не зависит от пользователя, а флаги
+    is_favorited, is_in_shopping_cart и is_subscribed проставляются
+    в Python. Запись живёт не дольше timeout секунд: с кэшем в памяти
+    процесса сброс не доходит до других воркеров. Множество читается
+    из основной базы: отстающая реплика положила бы в кэш связи без
+    только что сделанного изменения.
+    """
+
+    def __init__(self, prefix='memberships', timeout=None):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self, user_id, kind):
+        return f'{self.prefix}:{kind}:{user_id}'
+
+    def get(self, user, kinds=tuple(MEMBERSHIP_KINDS)):
+        if not user.is_authenticated:
+            return EMPTY_MEMBERSHIPS
+        keys = {kind: self._key(user.id, kind) for kind in kinds}
+        cached = cache.get_many(keys.values())
+        memberships = {}
+        for kind, key in keys.items():
+            if key in cached:
+                memberships[kind] = cached[key]
+                continue
+            model, field = MEMBERSHIP_KINDS[kind]
+            with primary():
+                memberships[kind] = frozenset(model.objects.filter(
+                    user=user
+                ).values_list(field, flat=True))
+            cache.set(key, memberships[kind], self.timeout)
+        return memberships
+
+    async def aget(self, user, kinds=tuple(MEMBERSHIP_KINDS)):
+        """get на асинхронном ORM."""
+        if not user.is_authenticated:
+            return EMPTY_MEMBERSHIPS
+        keys = {kind: self._key(user.id, kind) for kind in kinds}
+        cached = await cache.aget_many(keys.values())
+        memberships = {}
+        for kind, key in keys.items():
+            if key in cached:
+                memberships[kind] = cached[key]
+                continue
+            model, field = MEMBERSHIP_KINDS[kind]
+            with primary():
+                memberships[kind] = frozenset([
+                    value async for value in model.objects.filter(
+                        user=user
+                    ).values_list(field, flat=True)
+                ])
+            await cache.aset(key, memberships[kind], self.timeout)
+        return memberships
+
+    def invalidate(self, user_id, kind):
+        key = self._key(user_id, kind)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+recipe_memberships = RecipeMemberships(
+    timeout=settings.MEMBERSHIPS_CACHE_TIMEOUT
+)
+
+
+def apply_memberships(data, memberships):
+    """Проставляет пользовательские флаги в сериализованные рецепты."""
+    if isinstance(data, dict) and 'results' in data:
+        recipes = data['results']
+    elif isinstance(data, list):
+        recipes = data
+    else:
+        recipes = (data,)
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in memberships['favorites']
+        recipe['is_in_shopping_cart'] = recipe['id'] in memberships['cart']
+        author = recipe.get('author')
+        if author:
+            author['is_subscribed'] = (
+                author['id'] in memberships['following']
+            )
+    return data
@@ -1,10 +1,170 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
 
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset на асинхронном ORM."""
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # COUNT(*) заранее: дальше Paginator его не запрашивает.
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        self.page.object_list = [
+            obj async for obj in self.page.object_list
+        ]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+
+class RecipeCursorPagination(BasePagination):
+    """Keyset-пагинация ленты рецептов по (pub_date, id).
+
+    Порядок совпадает с Recipe.Meta.ordering (новые сверху), id
+    разрешает совпадения pub_date. Страница выбирается условием
+    WHERE по ключу последней записи, а не OFFSET, поэтому глубокие
+    страницы стоят столько же, сколько первая. Курсоры непрозрачные,
+    COUNT(*) выполняется только при ?count=true.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, '')
+        if not value.isdigit() or int(value) < 1:
+            return self.page_size
+        return int(value)
+
+    def encode_cursor(self, recipe, reverse):
+        # Страница состоит из рецептов или из строк .values().
+        if isinstance(recipe, dict):
+            pub_date, pk = recipe['pub_date'], recipe['id']
+        else:
+            pub_date, pk = recipe.pub_date, recipe.pk
+        raw = f'{int(reverse)}|{pub_date.isoformat()}|{pk}'
+        cursor = urlsafe_b64encode(raw.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            reverse, pub_date, pk = urlsafe_b64decode(
+                cursor.encode()
+            ).decode().split('|')
+            return (
+                bool(int(reverse)), datetime.fromisoformat(pub_date), int(pk)
+            )
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param) in (
+            'true', 'True', '1')
+
+    def page_queryset(self, queryset, request):
+        """Срез на одну запись больше страницы: есть ли следующая."""
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = cursor = self.decode_cursor(request)
+        if cursor is None:
+            reverse = False
+            queryset = queryset.order_by('-pub_date', '-pk')
+        else:
+            reverse, pub_date, pk = cursor
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date)
+                    | Q(pub_date=pub_date, pk__gt=pk)
+                ).order_by('pub_date', 'pk')
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date)
+                    | Q(pub_date=pub_date, pk__lt=pk)
+                ).order_by('-pub_date', '-pk')
+        self.reverse = reverse
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, page):
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        self.page = page
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = queryset.count() if self.wants_count(request) else None
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if self.wants_count(request):
+            self.count = await queryset.acount()
+        return self.set_page(
+            [obj async for obj in self.page_queryset(queryset, request)]
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(
+                self.base_url, self.cursor_query_param, ''
+            )
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
 
-class RecipesLimitPagination(PageNumberPagination):
-    page_size_query_param = 'recipes_limit'
+def get_recipes_limit(request):
+    """Значение ?recipes_limit= или None, если оно не задано или неверно."""
+    value = request.query_params.get('recipes_limit', '')
+    if not value.isdigit() or int(value) < 1:
+        return None
+    return int(value)
@@ -0,0 +1,251 @@
+import threading
+import time
+from datetime import timedelta
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from recipes.models import IngredientsRecipe, Recipe
+
+from .db_router import primary
+
+# Изменения, закоммиченные позже, чем выставлен их updated_at, тоже
+# попадают в следующую синхронизацию.
+SYNC_OVERLAP = timedelta(seconds=60)
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+class PantryMatch:
+    """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+    Массивы id, covered (сколько ингредиентов рецепта есть) и total
+    (сколько их всего) не упорядочены. Срез match[start:stop] — список
+    (id, covered, total) по порядку: сначала большая доля найденных
+    ингредиентов, затем большее их число, затем новые рецепты. Срез
+    сортирует только первые stop совпадений, а не все, поэтому так же
+    его читает и Paginator. Память — несколько массивов длины
+    совпадений, сколько бы ингредиентов ни было в рецептах.
+    """
+
+    def __init__(self, ids, covered, total):
+        self.ids = ids
+        self.covered = covered
+        self.total = total
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(len(self))
+        order = self.order(stop)[start:stop:step]
+        return list(zip(
+            self.ids[order].tolist(),
+            self.covered[order].tolist(),
+            self.total[order].tolist(),
+        ))
+
+    def order(self, stop):
+        """Позиции первых stop совпадений по порядку."""
+        if stop <= 0:
+            return np.empty(0, dtype=np.intp)
+        # Равные дроби делятся в одно и то же число, разные — в разные.
+        share = self.covered / self.total
+        if stop < len(self):
+            # Доля stop-го совпадения: всё, что выше, входит целиком,
+            # а из равных ей берутся лучшие по covered и id.
+            threshold = np.partition(share, len(self) - stop)[-stop]
+            above = np.flatnonzero(share > threshold)
+            tied = np.flatnonzero(share == threshold)
+            need = stop - len(above)
+            if need < len(tied):
+                keys = (
+                    self.covered[tied] * (int(self.ids.max()) + 1)
+                    + self.ids[tied]
+                )
+                tied = tied[np.argpartition(-keys, need - 1)[:need]]
+            positions = np.concatenate((above, tied))
+        else:
+            positions = np.arange(len(self))
+        order = np.lexsort((
+            -self.ids[positions],
+            -self.covered[positions],
+            -share[positions],
+        ))
+        return positions[order]
+
+    def missing_one(self):
+        """Те же рецепты, которым не хватает ровно одного ингредиента."""
+        mask = self.total - self.covered == 1
+        return PantryMatch(
+            self.ids[mask], self.covered[mask], self.total[mask]
+        )
+
+
+class PantryIndex:
+    """Обратный индекс ингредиент -> рецепты в памяти процесса.
+
+    Для каждого ингредиента хранит отсортированный массив int32 с id
+    рецептов, в которых он есть, а для каждого рецепта (по id) — число
+    его ингредиентов. Подбор рецептов по набору ингредиентов — это
+    bincount склеенных массивов, без запросов к базе.
+
+    Индекс целиком собирается при первом обращении и раз в ttl секунд.
+    Между сборками он догоняет базу раз в sync_interval секунд: читает
+    рецепты, у которых изменился updated_at, и заменяет их ингредиенты.
+    Изменения в своём процессе видны сразу (mark_changed), удалённые
+    рецепты убираются discard.
+    """
+
+    def __init__(self, ttl=None, sync_interval=None):
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._sizes = np.zeros(1, dtype=np.int16)
+        self._built_at = None
+        self._synced_at = None
+        self._synced_to = None
+
+    def build(self):
+        synced_to = timezone.now()
+        rows = IngredientsRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        pairs = np.fromiter(
+            chain.from_iterable(rows.iterator(chunk_size=10_000)),
+            dtype=np.int32,
+        ).reshape(-1, 2)
+        ingredient_ids, recipe_ids = pairs[:, 0], pairs[:, 1].copy()
+        postings = {}
+        if len(pairs):
+            # Массивы рецептов — срезы одного массива, без копий.
+            starts = np.flatnonzero(np.diff(ingredient_ids)) + 1
+            postings = dict(zip(
+                ingredient_ids[np.r_[0, starts]].tolist(),
+                np.split(recipe_ids, starts),
+            ))
+        sizes = np.bincount(recipe_ids, minlength=1).astype(np.int16)
+        self._postings, self._sizes = postings, sizes
+        self._built_at = self._synced_at = time.monotonic()
+        self._synced_to = synced_to
+
+    def sync(self):
+        """Заменяет в индексе рецепты, изменённые с прошлой синхронизации."""
+        synced_to = timezone.now()
+        since = self._synced_to - SYNC_OVERLAP
+        changed = np.fromiter(
+            Recipe.objects.filter(updated_at__gt=since).values_list(
+                'id', flat=True
+            ),
+            dtype=np.int32,
+        )
+        if len(changed):
+            rows = IngredientsRecipe.objects.filter(
+                recipe__updated_at__gt=since
+            ).order_by('ingredient_id', 'recipe_id').values_list(
+                'ingredient_id', 'recipe_id'
+            )
+            self._remove(np.sort(changed))
+            self._add(list(rows))
+        self._synced_at = time.monotonic()
+        self._synced_to = synced_to
+
+    def _remove(self, recipe_ids):
+        for ingredient_id, posting in list(self._postings.items()):
+            positions = np.searchsorted(posting, recipe_ids)
+            found = positions < len(posting)
+            positions = positions[found]
+            positions = positions[posting[positions] == recipe_ids[found]]
+            if len(positions):
+                self._postings[ingredient_id] = np.delete(posting, positions)
+        recipe_ids = recipe_ids[recipe_ids < len(self._sizes)]
+        self._sizes[recipe_ids] = 0
+
+    def _add(self, rows):
+        by_ingredient = {}
+        for ingredient_id, recipe_id in rows:
+            by_ingredient.setdefault(ingredient_id, []).append(recipe_id)
+        for ingredient_id, recipe_ids in by_ingredient.items():
+            self._postings[ingredient_id] = np.union1d(
+                self._postings.get(ingredient_id, _EMPTY),
+                np.array(recipe_ids, dtype=np.int32),
+            )
+        counts = np.bincount(
+            np.fromiter((recipe_id for _, recipe_id in rows), dtype=np.int32)
+        )
+        if len(counts) > len(self._sizes):
+            sizes = np.zeros(len(counts), dtype=np.int16)
+            sizes[:len(self._sizes)] = self._sizes
+            self._sizes = sizes
+        self._sizes[:len(counts)] += counts.astype(np.int16)
+
+    def invalidate(self):
+        self._built_at = None
+
+    def mark_changed(self):
+        """Рецепты изменились: догнать базу при следующем запросе."""
+        self._synced_at = None
+
+    def discard(self, recipe_ids):
+        """Убирает удалённые рецепты."""
+        with self._lock:
+            self._remove(np.sort(np.array(list(recipe_ids), dtype=np.int32)))
+
+    def is_stale(self):
+        return self._built_at is None or (
+            self.ttl is not None
+            and time.monotonic() - self._built_at > self.ttl
+        )
+
+    def needs_sync(self):
+        return self._synced_at is None or (
+            self.sync_interval is not None
+            and time.monotonic() - self._synced_at > self.sync_interval
+        )
+
+    def refresh(self):
+        # Из основной базы: с реплики синхронизация сдвинула бы
+        # _synced_to дальше ещё не доехавших до неё изменений.
+        if self.is_stale():
+            with self._lock, primary():
+                if self.is_stale():
+                    self.build()
+        elif self.needs_sync():
+            with self._lock, primary():
+                if self.needs_sync():
+                    self.sync()
+
+    def match(self, ingredient_ids):
+        """PantryMatch для набора id ингредиентов."""
+        self.refresh()
+        postings = [
+            self._postings[ingredient_id]
+            for ingredient_id in set(ingredient_ids)
+            if ingredient_id in self._postings
+        ]
+        sizes = self._sizes
+        counts = np.bincount(np.concatenate([_EMPTY, *postings]))
+        # По маске вдвое быстрее, чем по самим счётчикам.
+        ids = np.flatnonzero(counts > 0)
+        if not len(ids):
+            return PantryMatch(_EMPTY, _EMPTY, _EMPTY)
+        covered = counts[ids]
+        # Индекс мог обновиться, пока читались массивы: рецепт, которого
+        # ещё нет в sizes, считаем целиком найденным.
+        if ids[-1] < len(sizes):
+            total = np.maximum(sizes[ids], covered)
+        else:
+            total = covered.copy()
+            known = ids < len(sizes)
+            total[known] = np.maximum(sizes[ids[known]], covered[known])
+        return PantryMatch(ids, covered, total)
+
+    def __len__(self):
+        return int(np.count_nonzero(self._sizes))
+
+
+pantry_index = PantryIndex(
+    ttl=settings.PANTRY_INDEX_TTL,
+    sync_interval=settings.PANTRY_INDEX_SYNC_INTERVAL,
+)
@@ -0,0 +1,64 @@
+from rest_framework.renderers import (BaseRenderer, BrowsableAPIRenderer,
+                                      JSONRenderer)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PlainTextRenderer(BaseRenderer):
+    """Рендерер для выгрузки в формате txt."""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Рендерер для выгрузки в формате csv."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+SHOPPING_LIST_RENDERERS = (PlainTextRenderer, CSVRenderer, JSONRenderer)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson: те же байты, но в несколько раз быстрее.
+
+    Даты и время отдаются кодировщику DRF, как и прочие типы, которые
+    orjson не знает. С отступами, без orjson или при ошибке
+    кодирования работает обычный JSONRenderer.
+    """
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if orjson is not None else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace('\u2029'.encode(), b'\\u2029')
+
+
+RECIPE_RENDERERS = (FastJSONRenderer, BrowsableAPIRenderer)
@@ -1,13 +1,21 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import transaction
-from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
+from recipes.images import schedule_image_variants
 from recipes.models import (Favorite, Ingredient, IngredientsRecipe,
-                            PurchasingList, Recipe, Tag, TagsRecipe)
+                            PurchasingList, Recipe, Tag, TagsRecipe,
+                            get_tags_mask)
+from recipes.search import index_recipes
 from rest_framework import serializers, status
 from users.models import Follow
 
+from .cache import recipe_cache
+from .memberships import recipe_memberships
+from .services import update_recipe_in_shopping_lists
+
 User = get_user_model()
 
 
@@ -47,7 +55,12 @@ class CustomUserSerializer(UserSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.following.filter(user=request.user).exists()
+        # Контекст общий для всех пользователей страницы.
+        if 'following' not in self.context:
+            self.context['following'] = recipe_memberships.get(
+                request.user, ('following',)
+            )['following']
+        return obj.id in self.context['following']
 
 
 class UserSerializer(UserSerializer):
@@ -78,8 +91,8 @@ class TagSerializer(serializers.ModelSerializer):
     """Serializer for Tag model."""
     class Meta:
         model = Tag
-        fields = '__all__'
-        read_only_fields = (fields,)
+        fields = ('id', 'name', 'color', 'slug')
+        read_only_fields = fields
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -96,6 +109,10 @@ class IngredientRecipeSmallSerializer(serializers.ModelSerializer):
         model = IngredientsRecipe
         fields = ('id', 'amount')
 
+    def to_representation(self, instance):
+        # ingredient_id уже в строке, сам ингредиент не загружаем.
+        return {'id': instance.ingredient_id, 'amount': instance.amount}
+
 
 class IngredientsRecipeSerializer(serializers.ModelSerializer):
     """Serializer for IngredientsRecipe model."""
@@ -109,6 +126,26 @@ class IngredientsRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+def image_variant_urls(variants, request=None):
+    """{width: {format: name}} -> {width: {format: url}}."""
+    urls = {}
+    for width, formats in variants.items():
+        urls[width] = {}
+        for extension, name in formats.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[width][extension] = url
+    return urls
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URL уменьшенных копий картинки: {width: {format: url}}."""
+
+    def to_representation(self, value):
+        return image_variant_urls(value, self.context.get('request'))
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for Recipe model."""
 
@@ -117,19 +154,115 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time', 'tags')
 
 
+class RecipeAuthorSerializer(UserSerializer):
+    """Автор рецепта, is_subscribed проставляет apply_memberships."""
+    is_subscribed = serializers.BooleanField(read_only=True, default=False)
+
+
 class RecipeGetSerializer(serializers.ModelSerializer):
     is_favorited = serializers.BooleanField(read_only=True, default=False)
     is_in_shopping_cart = serializers.BooleanField(
         read_only=True,
         default=False)
     tags = TagSerializer(many=True)
-    author = UserSerializer()
+    author = RecipeAuthorSerializer()
     ingredients = IngredientsRecipeSerializer(
         source='ingredients_list', many=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('tags_mask', 'updated_at')
+
+
+class TagPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """id тега; при пакетной загрузке теги берутся из контекста."""
+
+    def to_internal_value(self, data):
+        tags = self.context.get('tags')
+        if tags is None:
+            return super().to_internal_value(data)
+        try:
+            return tags[int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Пакетное создание рецептов.
+
+    Перед проверкой элементов все id тегов и ингредиентов из запроса
+    проверяются двумя запросами, дальше элементы валидируются без
+    обращений к базе. Ошибки возвращаются по каждому элементу, а
+    создаются рецепты только если весь пакет корректен: несколькими
+    многострочными INSERT в одной транзакции.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, dict)]
+            tag_ids = {
+                as_int(tag_id) for item in items
+                for tag_id in item.get('tags') or ()
+                if not isinstance(tag_id, (dict, list))
+            }
+            ingredient_ids = {
+                as_int(ingredient.get('id')) for item in items
+                for ingredient in item.get('ingredients') or ()
+                if isinstance(ingredient, dict)
+                and not isinstance(ingredient.get('id'), (dict, list))
+            }
+            self.context['tags'] = Tag.objects.in_bulk(
+                tag_ids - {None}
+            )
+            self.context['ingredient_ids'] = set(
+                Ingredient.objects.filter(
+                    id__in=ingredient_ids - {None}
+                ).values_list('id', flat=True)
+            )
+        return super().to_internal_value(data)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        author = validated_data[0]['author']
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=item['name'],
+                description=item['description'],
+                image=item['image'],
+                cooking_time=item['cooking_time'],
+                tags_mask=get_tags_mask(item['tags']),
+            )
+            for item in validated_data
+        )
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=recipe, tag=tag)
+            for recipe, item in zip(recipes, validated_data)
+            for tag in item['tags']
+        )
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient['ingredient']['id'],
+                amount=ingredient['amount'],
+            )
+            for recipe, item in zip(recipes, validated_data)
+            for ingredient in item['ingredients_list']
+        )
+        # bulk_create не шлёт сигналов: кэш и поисковую таблицу
+        # обновляем сами.
+        recipe_cache.invalidate_recipes(*(recipe.id for recipe in recipes))
+        index_recipes(recipes)
+        schedule_image_variants(recipes)
+        return recipes
 
 
 class RecipePostSerializer(serializers.ModelSerializer):
@@ -143,7 +276,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
         source='ingredients_list',
         many=True
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = TagPrimaryKeyField(
         queryset=Tag.objects.all(),
         many=True
     )
@@ -151,14 +284,23 @@ class RecipePostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        exclude = ('description',)
+        exclude = ('description', 'tags_mask', 'updated_at')
+        list_serializer_class = RecipeListSerializer
 
     def validate_ingredients(self, ingredients):
         ids = [i['ingredient']['id'] for i in ingredients]
         ingredients_set = set(ids)
         if len(ids) != len(ingredients_set):
             raise serializers.ValidationError('Ингредиент повторяется')
-        if Ingredient.objects.filter(id__in=ids).count() != len(ids):
+        if len(ids) > settings.RECIPE_MAX_INGREDIENTS:
+            raise serializers.ValidationError(
+                'Ингредиентов не больше '
+                f'{settings.RECIPE_MAX_INGREDIENTS}')
+        known_ids = self.context.get('ingredient_ids')
+        if known_ids is not None:
+            if not ingredients_set <= known_ids:
+                raise serializers.ValidationError('Ингредиент отсутствует')
+        elif Ingredient.objects.filter(id__in=ids).count() != len(ids):
             raise serializers.ValidationError('Ингредиент отсутствует')
 
         for ingredient in ingredients:
@@ -169,13 +311,13 @@ class RecipePostSerializer(serializers.ModelSerializer):
 
     def add_tags_and_ingredients(self, tags, ingredients, recipe):
         recipe.tags.set(tags)
+        recipe.tags_mask = get_tags_mask(tags)
+        recipe.save(update_fields=('tags_mask',))
 
         IngredientsRecipe.objects.bulk_create(
             IngredientsRecipe(
                 recipe=recipe,
-                ingredient=get_object_or_404(
-                    Ingredient, id=ingredient['ingredient']['id']
-                ),
+                ingredient_id=ingredient['ingredient']['id'],
                 amount=ingredient['amount']
             )
             for ingredient in ingredients)
@@ -188,20 +330,104 @@ class RecipePostSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe = self.add_tags_and_ingredients(tags, ingredients, recipe)
+        schedule_image_variants((recipe,))
 
         return recipe
 
+    def update_tags(self, instance, tags):
+        """Добавляет и удаляет только изменившиеся теги."""
+        old_ids = {tag.id for tag in instance.tags.all()}
+        new_ids = {tag.id for tag in tags}
+        if old_ids == new_ids:
+            return False
+        if old_ids - new_ids:
+            TagsRecipe.objects.filter(
+                recipe=instance, tag_id__in=old_ids - new_ids
+            ).delete()
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=instance, tag=tag)
+            for tag in tags if tag.id not in old_ids
+        )
+        instance.tags_mask = get_tags_mask(tags)
+        return True
+
+    def update_ingredients(self, instance, ingredients):
+        """Пишет только добавленные, удалённые и изменённые ингредиенты."""
+        old_rows = {
+            row.ingredient_id: row
+            for row in IngredientsRecipe.objects.filter(recipe=instance)
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in old_rows.items()
+        }
+        new_amounts = {
+            ingredient['ingredient']['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        if old_amounts == new_amounts:
+            return False
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            IngredientsRecipe.objects.filter(
+                recipe=instance, ingredient_id__in=removed
+            ).delete()
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in old_rows
+        )
+        changed = []
+        for ingredient_id, row in old_rows.items():
+            amount = new_amounts.get(ingredient_id, row.amount)
+            if amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientsRecipe.objects.bulk_update(changed, ('amount',))
+        # Удалённые строки из списков покупок вычли сигналы post_delete,
+        # bulk_create и bulk_update сигналов не шлют.
+        update_recipe_in_shopping_lists(
+            instance.id,
+            {
+                ingredient_id: amount
+                for ingredient_id, amount in old_amounts.items()
+                if ingredient_id not in removed
+            },
+            new_amounts,
+        )
+        return True
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients_list')
-        tags = validated_data.pop('tags')
-        TagsRecipe.objects.filter(recipe=instance).delete()
-        IngredientsRecipe.objects.filter(recipe=instance).delete()
-        instance = self.add_tags_and_ingredients(
-            tags, ingredients, instance
-        )
-        super().update(instance, validated_data)
-        instance.save()
+        ingredients = validated_data.pop('ingredients_list', None)
+        tags = validated_data.pop('tags', None)
+        update_fields = []
+        if tags is not None and self.update_tags(instance, tags):
+            update_fields.append('tags_mask')
+        relations_changed = bool(update_fields)
+        if ingredients is not None:
+            relations_changed |= self.update_ingredients(
+                instance, ingredients
+            )
+        replaced_variants = None
+        if 'image' in validated_data:
+            replaced_variants = instance.image_variants
+            instance.image_variants = {}
+            update_fields.append('image_variants')
+        for field, value in validated_data.items():
+            if getattr(instance, field) != value:
+                setattr(instance, field, value)
+                update_fields.append(field)
+
+        if update_fields or relations_changed:
+            instance.save(update_fields=(*update_fields, 'updated_at'))
+        if 'image' in validated_data:
+            schedule_image_variants(
+                (instance,), {instance.pk: replaced_variants}
+            )
         return instance
 
 
@@ -248,10 +474,11 @@ class CurrentUserSerializer(UserSerializer):
 
 class SupportRecipesSerializer(serializers.ModelSerializer):
     """Сериализатор рецепта для добавления"""
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
 
 
 class SubscribeListSerializer(serializers.ModelSerializer):
@@ -262,7 +489,7 @@ class SubscribeListSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Follow
@@ -270,15 +497,13 @@ class SubscribeListSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        return SupportRecipesSerializer(recipes, many=True).data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        return recipes.count()
+        """Рецепты из author_recipes_prefetch."""
+        return SupportRecipesSerializer(
+            obj.author.preview_recipes, many=True
+        ).data
 
     def get_is_subscribed(self, obj):
-        return CurrentUserSerializer.get_is_subscribed(self, obj.author)
+        return True
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -315,3 +540,58 @@ class PurchasingListSerializer(serializers.ModelSerializer):
     class Meta:
         model = PurchasingList
         fields = '__all__'
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций с избранным и корзиной."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BULK_LIMIT,
+    )
+
+    def validate_recipes(self, recipes):
+        recipes = set(recipes)
+        missing = recipes - set(
+            Recipe.objects.filter(id__in=recipes).values_list('id', flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                'Рецепты не найдены: '
+                + ', '.join(map(str, sorted(missing)))
+            )
+        return recipes
+
+
+class PantrySerializer(serializers.Serializer):
+    """Ингредиенты, из которых подбираются рецепты."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS,
+    )
+
+
+class PantryRecipeSerializer(SupportRecipesSerializer):
+    """Рецепт из подбора: сколько из его ингредиентов уже есть."""
+    covered = serializers.IntegerField(read_only=True)
+    total = serializers.IntegerField(read_only=True)
+
+    class Meta(SupportRecipesSerializer.Meta):
+        fields = SupportRecipesSerializer.Meta.fields + ('covered', 'total')
+
+
+class PantrySuggestionSerializer(PantryRecipeSerializer):
+    """Рецепт, для которого не хватает одного ингредиента."""
+    missing = IngredientSerializer(read_only=True)
+
+    class Meta(PantryRecipeSerializer.Meta):
+        fields = PantryRecipeSerializer.Meta.fields + ('missing',)
+
+
+class SimilarRecipeSerializer(SupportRecipesSerializer):
+    """Похожий рецепт и его близость к исходному, от 0 до 1."""
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(SupportRecipesSerializer.Meta):
+        fields = SupportRecipesSerializer.Meta.fields + ('score',)
@@ -1,31 +1,322 @@
+import csv
+import json
+from itertools import islice
+
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
-from recipes.models import Ingredient, IngredientsRecipe, PurchasingList
+from django.db import transaction
+from django.db.models import F, Prefetch, Sum, Window
+from django.db.models.functions import RowNumber
+from recipes.models import (IngredientsRecipe, PurchasingList, Recipe,
+                            ShoppingListItem)
 
 User = get_user_model()
 
+SHOPPING_LIST_CHUNK_SIZE = 500
+SHOPPING_LIST_FIELDS = ('name', 'amount', 'measurement_unit')
 
-def get_shopping_list(user: User):
 
-    carts = PurchasingList.objects.filter(user=user)
-    recipes = [cart.recipe for cart in carts]
-    cart = {}
-    for recipe in recipes:
-        for ingredient in recipe.ingredients.all():
-            amount = get_object_or_404(
-                IngredientsRecipe,
-                recipe=recipe,
-                ingredient=ingredient
-            ).amount
-            if ingredient.name not in cart:
-                cart[ingredient.name] = amount
+def aggregate_shopping_list(user: User):
+    """Ингредиенты корзины, просуммированные одним запросом.
+
+    Группировка идёт по id ингредиента и единице измерения,
+    а не по названию. Это источник истины для ShoppingListItem.
+    """
+    return IngredientsRecipe.objects.filter(
+        recipe__purchasing_list__user=user
+    ).values(
+        'ingredient__id',
+        'ingredient__name',
+        'ingredient__measurement_unit',
+    ).annotate(
+        total=Sum('amount')
+    ).order_by('ingredient__name', 'ingredient__id')
+
+
+SHOPPING_LIST_ITEM_FIELDS = (
+    'ingredient__name',
+    'amount',
+    'ingredient__measurement_unit',
+)
+
+
+def get_shopping_list_items(user: User):
+    """Готовый список покупок пользователя из ShoppingListItem."""
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).values_list(
+        *SHOPPING_LIST_ITEM_FIELDS
+    ).order_by('ingredient__name', 'ingredient__id')
+
+
+def get_recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте: {ingredient_id: amount}."""
+    return dict(
+        IngredientsRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+def lock_users(user_ids):
+    """Блокирует строки пользователей до конца транзакции, возвращает id.
+
+    Строки блокируются по возрастанию id, чтобы две транзакции с
+    общими пользователями не ждали друг друга по кругу.
+    """
+    return list(
+        User.objects.select_for_update().filter(
+            pk__in=user_ids
+        ).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+# Вызывается из сигналов внутри транзакции записи: без своей точки
+# сохранения, ошибка и так откатывает всю запись.
+@transaction.atomic(savepoint=False)
+def change_shopping_lists(user_ids, deltas):
+    """Прибавляет deltas ({ingredient_id: amount}) к спискам покупок.
+
+    Отрицательные значения вычитаются, позиции с нулевым
+    количеством удаляются. Списки меняются под блокировкой их
+    пользователей: select_for_update позиций не видит ещё не созданные
+    строки, и два параллельных добавления нового ингредиента упали бы
+    на уникальности.
+    """
+    deltas = {
+        ingredient_id: amount
+        for ingredient_id, amount in deltas.items() if amount
+    }
+    if not deltas:
+        return
+    user_ids = lock_users(user_ids)
+    if not user_ids:
+        return
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user_id__in=user_ids,
+            ingredient_id__in=deltas,
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, amount in deltas.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                if amount > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    ))
+                continue
+            item.amount += amount
+            if item.amount > 0:
+                to_update.append(item)
             else:
-                cart[ingredient.name] += amount
-    content = ''
-    for item in cart:
-        units = get_object_or_404(
-            Ingredient,
-            name=item
-        ).measurement_unit
-        content += f'{item}: {cart[item]}{units}\n'
-    return content
+                to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ('amount',))
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def get_recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов."""
+    return dict(
+        IngredientsRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by()
+    )
+
+
+def add_to_shopping_list(user: User, *recipe_ids):
+    change_shopping_lists((user.id,), get_recipes_amounts(recipe_ids))
+
+
+def remove_from_shopping_list(user: User, *recipe_ids):
+    change_shopping_lists(
+        (user.id,),
+        {
+            ingredient_id: -amount
+            for ingredient_id, amount
+            in get_recipes_amounts(recipe_ids).items()
+        }
+    )
+
+
+def clear_shopping_list(user: User):
+    """Корзина очищена: список покупок пуст."""
+    ShoppingListItem.objects.filter(user=user).delete()
+
+
+def get_cart_user_ids(recipe_id):
+    return PurchasingList.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True)
+
+
+def update_recipe_in_shopping_lists(recipe_id, old_amounts, new_amounts):
+    """Применяет изменение состава рецепта ко всем корзинам с ним."""
+    deltas = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    change_shopping_lists(get_cart_user_ids(recipe_id), deltas)
+
+
+def compute_shopping_lists(user_ids=None):
+    """Суммы по всем корзинам: (user_id, ingredient_id, amount)."""
+    # Условие на корзины — одно и в одном filter(): каждый filter() по
+    # многозначной связи добавляет свой JOIN корзин, и суммы умножились
+    # бы на число корзин с рецептом.
+    carts = {'recipe__purchasing_list__isnull': False}
+    if user_ids is not None:
+        carts = {'recipe__purchasing_list__user__in': user_ids}
+    return IngredientsRecipe.objects.filter(**carts).values_list(
+        'recipe__purchasing_list__user', 'ingredient'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by()
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids=None, batch_size=1000):
+    """Пересобирает ShoppingListItem из корзин пользователей."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    rows = compute_shopping_lists(user_ids).iterator(chunk_size=batch_size)
+    while batch := list(islice(rows, batch_size)):
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for user_id, ingredient_id, amount in batch
+        )
+
+
+def author_recipes_prefetch(lookup, recipes_limit=None):
+    """Prefetch последних рецептов авторов одним запросом.
+
+    При заданном recipes_limit каждому автору достаётся не больше
+    recipes_limit рецептов: ROW_NUMBER() в окне по автору.
+    Результат лежит в атрибуте preview_recipes.
+    """
+    recipes = Recipe.objects.select_related(None).prefetch_related(
+        None
+    ).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author'
+    )
+    if recipes_limit is not None:
+        recipes = recipes.annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).filter(position__lte=recipes_limit)
+    return Prefetch(lookup, queryset=recipes, to_attr='preview_recipes')
+
+
+def iter_shopping_list_rows(user: User):
+    """Строки списка покупок, читаемые курсором на стороне сервера."""
+    return get_shopping_list_items(user).iterator(
+        chunk_size=SHOPPING_LIST_CHUNK_SIZE
+    )
+
+
+async def aiter_shopping_list_rows(user: User):
+    """iter_shopping_list_rows для асинхронного ORM."""
+    # aiterator() строк values_list в Django 4.2 выполняет запрос прямо
+    # в цикле событий, у values() чтение идёт в потоке.
+    async for item in get_shopping_list_items(user).values(
+        *SHOPPING_LIST_ITEM_FIELDS
+    ).aiterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE):
+        yield tuple(item[field] for field in SHOPPING_LIST_ITEM_FIELDS)
+
+
+class _EchoBuffer:
+    """Буфер для csv.writer, который сразу возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    """Формат выгрузки: начало, строка на позицию через разделитель, конец.
+
+    Вызов с итератором строк даёт генератор, aiter — асинхронный
+    генератор над асинхронным итератором.
+    """
+
+    def __init__(self, format_row, head='', separator='', tail=''):
+        self.format_row = format_row
+        self.head = head
+        self.separator = separator
+        self.tail = tail
+
+    def __call__(self, rows):
+        if self.head:
+            yield self.head
+        separator = ''
+        for row in rows:
+            yield separator + self.format_row(row)
+            separator = self.separator
+        if self.tail:
+            yield self.tail
+
+    async def aiter(self, rows):
+        if self.head:
+            yield self.head
+        separator = ''
+        async for row in rows:
+            yield separator + self.format_row(row)
+            separator = self.separator
+        if self.tail:
+            yield self.tail
+
+
+def format_txt_row(row):
+    name, amount, measurement_unit = row
+    return f'{name}: {amount}{measurement_unit}\n'
+
+
+def format_json_row(row):
+    return json.dumps(dict(zip(SHOPPING_LIST_FIELDS, row)), ensure_ascii=False)
+
+
+def format_csv_row(row):
+    return csv.writer(_EchoBuffer()).writerow(row)
+
+
+SHOPPING_LIST_EXPORTERS = {
+    'txt': ShoppingListExporter(format_txt_row),
+    'csv': ShoppingListExporter(
+        format_csv_row, head=format_csv_row(SHOPPING_LIST_FIELDS)
+    ),
+    'json': ShoppingListExporter(
+        format_json_row, head='[', separator=',', tail=']'
+    ),
+}
+
+
+def iter_shopping_list(user: User, export_format='txt'):
+    """Генератор выгрузки списка покупок в выбранном формате."""
+    exporter = SHOPPING_LIST_EXPORTERS[export_format]
+    return exporter(iter_shopping_list_rows(user))
+
+
+def aiter_shopping_list(user: User, export_format='txt'):
+    """Асинхронный генератор выгрузки для ASGI."""
+    exporter = SHOPPING_LIST_EXPORTERS[export_format]
+    return exporter.aiter(aiter_shopping_list_rows(user))
+
+
+def get_shopping_list(user: User):
+    return ''.join(iter_shopping_list(user))
@@ -0,0 +1,250 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.db import transaction
+from django.utils import timezone
+from django.dispatch import receiver
+from recipes.models import (Ingredient, IngredientsRecipe, PurchasingList,
+                            Recipe, Tag, TagsRecipe, get_tags_mask)
+from recipes.search import index_recipes, unindex_recipes
+
+from .cache import recipe_cache
+from .ingredient_index import ingredient_index
+from .pantry import pantry_index
+from .services import (change_shopping_lists, get_recipe_amounts,
+                       update_recipe_in_shopping_lists)
+from .tag_bits import tag_bits
+
+User = get_user_model()
+
+# Поля пользователя, которые попадают в author у рецепта.
+AUTHOR_FIELDS = frozenset(
+    ('id', 'username', 'email', 'first_name', 'last_name')
+)
+# Поля рецепта в полнотекстовом поиске.
+SEARCH_FIELDS = frozenset(('name', 'description'))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_bits(**kwargs):
+    tag_bits.invalidate()
+
+
+# Поисковая таблица SQLite, PostgreSQL обновляет индекс сам.
+@receiver(post_save, sender=Recipe)
+def index_recipe(instance, using, update_fields, **kwargs):
+    if update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        index_recipes((instance,), using)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(instance, using, **kwargs):
+    unindex_recipes((instance.pk,), using)
+
+
+# Другие процессы узнают об изменениях по Recipe.updated_at.
+@receiver(post_save, sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientsRecipe)
+def sync_pantry_index(**kwargs):
+    transaction.on_commit(pantry_index.mark_changed)
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_from_pantry_index(instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: pantry_index.discard((recipe_id,)))
+
+
+@receiver(post_delete, sender=Tag)
+def clear_deleted_tag_bit(instance, **kwargs):
+    # Бит освобождается и может достаться новому тегу.
+    Recipe.objects.filter(
+        tags_mask__gt=0
+    ).update(tags_mask=F('tags_mask').bitand(~instance.mask))
+
+
+@receiver(post_save, sender=TagsRecipe)
+def refresh_tags_mask(instance, **kwargs):
+    # RecipePostSerializer ведёт маску сам, здесь правки через админку.
+    tags = Tag.objects.filter(recipes=instance.recipe_id)
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        tags_mask=get_tags_mask(tags), updated_at=timezone.now()
+    )
+
+
+@receiver(post_delete, sender=TagsRecipe)
+def remove_tag_from_mask(instance, origin, **kwargs):
+    if isinstance(origin, (Recipe, Tag)):
+        return
+    bit = tag_bits.by_id().get(instance.tag_id)
+    if bit is not None:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            tags_mask=F('tags_mask').bitand(~(1 << bit)),
+            updated_at=timezone.now(),
+        )
+
+
+# ShoppingListItem следует за корзинами и составом рецептов при любой
+# записи через ORM: из API, админки, каскадом при удалении рецепта или
+# пользователя. bulk_create и QuerySet.update() сигналов не шлют, там
+# списки покупок обновляют сами.
+@receiver(post_save, sender=PurchasingList)
+def add_cart_recipe_to_shopping_list(instance, created, **kwargs):
+    if created:
+        change_shopping_lists(
+            (instance.user_id,), get_recipe_amounts(instance.recipe_id)
+        )
+
+
+@receiver(post_delete, sender=PurchasingList)
+def remove_cart_recipe_from_shopping_list(instance, **kwargs):
+    # При удалении рецепта его ингредиенты могут уйти раньше корзин:
+    # тогда их уже вычел сигнал IngredientsRecipe, и здесь вычитать
+    # нечего.
+    change_shopping_lists(
+        (instance.user_id,),
+        {
+            ingredient_id: -amount
+            for ingredient_id, amount
+            in get_recipe_amounts(instance.recipe_id).items()
+        },
+    )
+
+
+@receiver(pre_save, sender=IngredientsRecipe)
+def remember_saved_ingredient(instance, **kwargs):
+    # Строка до изменения: post_save вычтет её и прибавит новую.
+    instance._saved_row = None
+    if instance.pk is not None:
+        instance._saved_row = IngredientsRecipe.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientsRecipe)
+def update_ingredient_in_shopping_lists(instance, **kwargs):
+    saved = getattr(instance, '_saved_row', None)
+    old_amounts = {}
+    if saved is not None:
+        recipe_id, ingredient_id, amount = saved
+        if recipe_id == instance.recipe_id:
+            old_amounts = {ingredient_id: amount}
+        else:
+            update_recipe_in_shopping_lists(
+                recipe_id, {ingredient_id: amount}, {}
+            )
+    update_recipe_in_shopping_lists(
+        instance.recipe_id,
+        old_amounts,
+        {instance.ingredient_id: instance.amount},
+    )
+
+
+@receiver(post_delete, sender=IngredientsRecipe)
+def remove_ingredient_from_shopping_lists(instance, **kwargs):
+    update_recipe_in_shopping_lists(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {}
+    )
+
+
+# Recipe.updated_at: меняется всё, что попадает в представление рецепта.
+# Теги рецепта помечают его при обновлении маски выше.
+@receiver(post_save, sender=IngredientsRecipe)
+@receiver(post_delete, sender=IngredientsRecipe)
+def touch_recipe_ingredients(instance, origin=None, **kwargs):
+    # Удаление рецепта или ингредиента помечает рецепты само.
+    if not isinstance(origin, (Recipe, Ingredient)):
+        Recipe.objects.touch(pk=instance.recipe_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(instance, created=False, **kwargs):
+    if not created:
+        Recipe.objects.touch(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(instance, created=False, **kwargs):
+    if not created:
+        Recipe.objects.touch(ingredients=instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        Recipe.objects.touch(tags=instance)
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            Recipe.objects.touch(pk__in=pk_set)
+        else:
+            Recipe.objects.touch(pk=instance.pk)
+    elif action == 'post_clear' and not reverse:
+        Recipe.objects.touch(pk=instance.pk)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields is not None and AUTHOR_FIELDS.isdisjoint(update_fields):
+        return
+    Recipe.objects.touch(author=instance)
+
+
+@receiver(pre_delete, sender=User)
+def touch_deleted_author_recipes(instance, **kwargs):
+    Recipe.objects.touch(author=instance)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_recipe_cache_catalog(**kwargs):
+    recipe_cache.invalidate_all()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe_cache_recipe(instance, **kwargs):
+    recipe_cache.invalidate_recipes(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=TagsRecipe)
+@receiver((post_save, post_delete), sender=IngredientsRecipe)
+def invalidate_recipe_cache_relation(instance, **kwargs):
+    recipe_cache.invalidate_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_cache_tags(instance, action, reverse, pk_set,
+                                 **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        recipe_cache.invalidate_recipes(*(pk_set or ()))
+        if action == 'post_clear':
+            recipe_cache.invalidate_all()
+    else:
+        recipe_cache.invalidate_recipes(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipe_cache_author(instance, update_fields, **kwargs):
+    if update_fields is not None and AUTHOR_FIELDS.isdisjoint(update_fields):
+        return
+    recipe_ids = Recipe.objects.filter(
+        author=instance
+    ).values_list('id', flat=True)
+    if recipe_ids:
+        recipe_cache.invalidate_recipes(*recipe_ids)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_recipe_cache_deleted_author(**kwargs):
+    recipe_cache.invalidate_all()
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from recipes.models import Tag
+
+from .db_router import primary
+
+
+class TagBits:
+    """Реестр тегов: slug и id -> номер бита в Recipe.tags_mask.
+
+    Тегов немного и меняются они редко, поэтому реестр целиком лежит
+    в кэше и сбрасывается при сохранении или удалении тега. Фильтр
+    по тегам берёт из него и допустимые slug, и маску для запроса.
+    Запись живёт не дольше timeout секунд: с кэшем в памяти процесса
+    сброс не доходит до других воркеров. Реестр читается из основной
+    базы, как и всё, что попадает в кэш.
+    """
+
+    def __init__(self, key='tag_bits', timeout=None):
+        self.key = key
+        self.timeout = timeout
+
+    def _rows(self):
+        rows = cache.get(self.key)
+        if rows is None:
+            with primary():
+                rows = tuple(Tag.objects.values_list('id', 'slug', 'bit'))
+            cache.set(self.key, rows, self.timeout)
+        return rows
+
+    def warm(self):
+        self._rows()
+
+    def by_slug(self):
+        return {slug: bit for _, slug, bit in self._rows()}
+
+    def by_id(self):
+        return {tag_id: bit for tag_id, _, bit in self._rows()}
+
+    def choices(self):
+        return [(slug, slug) for _, slug, _ in self._rows()]
+
+    def mask(self, slugs):
+        bits = self.by_slug()
+        mask = 0
+        for slug in slugs:
+            if slug in bits:
+                mask |= 1 << bits[slug]
+        return mask
+
+    def invalidate(self):
+        cache.delete(self.key)
+        transaction.on_commit(lambda: cache.delete(self.key))
+
+
+tag_bits = TagBits(timeout=settings.TAG_BITS_CACHE_TIMEOUT)
@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from recipes.models import Favorite, PurchasingList
+from rest_framework.test import APIClient
+from users.models import Follow
+
+from .management.commands._bench import (create_catalog, create_recipes,
+                                         create_users)
+
+LIST_URL = '/api/recipes/'
+PAGE_SIZES = (1, 6, 50)
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api_tests',
+    }
+}
+
+
+@override_settings(CACHES=LOCAL_CACHE, DATABASE_REPLICAS=[])
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы.
+
+    Кэш очищается перед каждым запросом, поэтому каждый ответ
+    собирается целиком.
+    """
+
+    # Версия списка, COUNT(*), рецепты, теги, ингредиенты.
+    ANONYMOUS_QUERIES = 5
+    # И избранное, корзина и подписки читателя.
+    USER_QUERIES = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = create_users(5, 'author')
+        cls.reader, = create_users(1, 'reader')
+        tags, ingredients = create_catalog()
+        recipes = create_recipes(authors, 60, tags, ingredients)
+        Follow.objects.create(user=cls.reader, author=authors[0])
+        Favorite.objects.create(user=cls.reader, recipe=recipes[0])
+        PurchasingList.objects.create(user=cls.reader, recipe=recipes[1])
+
+    def assert_list_queries(self, client, expected):
+        for size in PAGE_SIZES:
+            with self.subTest(limit=size):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = client.get(LIST_URL, {'limit': size})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), size)
+
+    def test_anonymous(self):
+        self.assert_list_queries(APIClient(), self.ANONYMOUS_QUERIES)
+
+    def test_user(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        self.assert_list_queries(client, self.USER_QUERIES)
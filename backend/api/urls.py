@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (FavoriteViewSet, IngredientViewSet,
+from api.views import (FavoriteBulkViewSet, FavoriteViewSet,
+                       IngredientViewSet, PurchasingListBulkViewSet,
                        PurchasingListViewSet, RecipeViewSet, TagViewSet,
                        SubscribeListView, MainSubscribeViewSet)
 
@@ -14,6 +15,27 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
 
+    path(
+        'recipes/favorite/',
+        FavoriteBulkViewSet.as_view({'post': 'add', 'delete': 'clear'}),
+        name='favorites_bulk'
+    ),
+    path(
+        'recipes/favorite/remove/',
+        FavoriteBulkViewSet.as_view({'post': 'remove'}),
+        name='favorites_bulk_remove'
+    ),
+    path(
+        'recipes/shopping_cart/',
+        PurchasingListBulkViewSet.as_view({'post': 'add', 'delete': 'clear'}),
+        name='shopping_cart_bulk'
+    ),
+    path(
+        'recipes/shopping_cart/remove/',
+        PurchasingListBulkViewSet.as_view({'post': 'remove'}),
+        name='shopping_cart_bulk_remove'
+    ),
+
     path(
         'recipes/<int:recipe_id>/favorite/',
         FavoriteViewSet.as_view({'post': 'create', 'delete': 'delete'}),
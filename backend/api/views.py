@@ -1,89 +1,409 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import FileResponse
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from recipes.models import Favorite, Ingredient, PurchasingList, Recipe, Tag
+from recipes.models import (Favorite, Ingredient, IngredientsRecipe,
+                            PurchasingList, Recipe, Tag)
+from recipes.similar import similar_recipes
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import ListAPIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from users.models import Follow
 
-from .fav_cart_base_view_set import RelationBaseViewSet
+from .async_views import AsyncDispatchMixin, AsyncReadOnlyMixin
+from .cache import recipe_cache
+from .conditional import conditional_response, make_etag, set_validators
+from .fav_cart_base_view_set import RelationBaseViewSet, RelationBulkViewSet
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import PageLimitPagination
+from .ingredient_index import ingredient_index
+from .memberships import apply_memberships, recipe_memberships
+from .pantry import pantry_index
+from .pagination import (PageLimitPagination, RecipeCursorPagination,
+                         get_recipes_limit)
 from .permissions import IsAuthorOrReadOnly
+from .recipe_rows import aserialize_recipes, recipe_values
+from .renderers import RECIPE_RENDERERS, SHOPPING_LIST_RENDERERS
 from .serializers import (FavoriteSerializer, IngredientSerializer,
+                          PantryRecipeSerializer, PantrySerializer,
+                          PantrySuggestionSerializer,
                           PurchasingListSerializer, RecipeGetSerializer,
-                          RecipePostSerializer, SubscribeListSerializer,
-                          SubscribeSerializer, TagSerializer)
-from .services import get_shopping_list
+                          RecipePostSerializer, SimilarRecipeSerializer,
+                          SubscribeListSerializer, SubscribeSerializer,
+                          SupportRecipesSerializer, TagSerializer)
+from .services import (add_to_shopping_list, aiter_shopping_list,
+                       author_recipes_prefetch, clear_shopping_list,
+                       iter_shopping_list, remove_from_shopping_list)
 
 User = get_user_model()
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(AsyncReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AsyncReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
     pagination_class = None
 
+    async def list(self, request, *args, **kwargs):
+        """Поиск по префиксу названия идёт по индексу в памяти."""
+        name = request.query_params.get('name')
+        if name is None:
+            return await super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            if not limit.isdigit():
+                return Response(
+                    {'limit': 'Ожидается положительное целое число.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = int(limit)
+        return Response(await ingredient_index.asearch(name, limit))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+# Фильтры, результат которых зависит от пользователя: такие списки
+# не кэшируются.
+USER_FILTERS = frozenset(('is_favorited', 'is_in_shopping_cart'))
+
+
+class RecipeViewSet(AsyncDispatchMixin, viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrReadOnly,)
     filterset_class = RecipeFilter
     pagination_class = PageLimitPagination
+    renderer_classes = RECIPE_RENDERERS
 
     def get_queryset(self):
-        if self.request.method == 'GET':
-            return Recipe.objects.fill_favs_and_in_cart(
-                self.request.user)
+        if self.request.method == 'GET' and not settings.RECIPE_FAST_READS:
+            return Recipe.objects.for_reading()
 
         return Recipe.objects.all()
 
+    @property
+    def paginator(self):
+        """Keyset-пагинация включается параметром ?cursor= (пустой для
+        первой страницы), иначе используется постраничная."""
+        if RecipeCursorPagination.cursor_query_param in (
+                self.request.query_params):
+            self.pagination_class = RecipeCursorPagination
+        return super().paginator
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeGetSerializer
         return RecipePostSerializer
 
+    async def list(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        # Версия выборки: число рецептов и время последнего изменения.
+        state = await queryset.order_by().aaggregate(
+            count=Count('id'), last_modified=Max('updated_at')
+        )
+        memberships = await recipe_memberships.aget(request.user)
+        last_modified = state['last_modified']
+        version = (
+            state['count'], last_modified and last_modified.isoformat()
+        )
+        etag = make_etag(request, *version, memberships=memberships)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return set_validators(request, not_modified, etag, last_modified)
+
+        if USER_FILTERS.intersection(request.query_params):
+            response = await self.list_response(queryset)
+        else:
+            response = await recipe_cache.arespond(
+                await sync_to_async(recipe_cache.list_key)(request),
+                lambda: self.list_response(queryset),
+                version=version,
+            )
+        response = self.apply_memberships(response, memberships)
+        return set_validators(request, response, etag, last_modified)
+
+    async def retrieve(self, request, *args, **kwargs):
+        try:
+            last_modified = await Recipe.objects.filter(
+                pk=kwargs['pk']
+            ).values_list('updated_at', flat=True).afirst()
+        except (TypeError, ValueError):
+            last_modified = None
+        memberships = await recipe_memberships.aget(request.user)
+        if last_modified is not None:
+            etag = make_etag(
+                request, kwargs['pk'], last_modified.isoformat(),
+                memberships=memberships,
+            )
+            not_modified = conditional_response(request, etag, last_modified)
+            if not_modified is not None:
+                return set_validators(
+                    request, not_modified, etag, last_modified
+                )
+
+        response = await recipe_cache.arespond(
+            await sync_to_async(recipe_cache.detail_key)(
+                request, kwargs['pk']
+            ),
+            self.retrieve_response,
+            version=last_modified and last_modified.isoformat(),
+        )
+        response = self.apply_memberships(response, memberships)
+        if last_modified is None:
+            return response
+        return set_validators(request, response, etag, last_modified)
+
+    async def list_response(self, queryset):
+        """Страница рецептов: из строк .values() или сериализатором."""
+        if not settings.RECIPE_FAST_READS:
+            return await sync_to_async(super().list)(
+                self.request, *self.args, **self.kwargs
+            )
+        rows = recipe_values(queryset)
+        page = await self.apaginate_queryset(rows)
+        if page is None:
+            page = [row async for row in rows]
+            return Response(await aserialize_recipes(page, self.request))
+        return self.get_paginated_response(
+            await aserialize_recipes(page, self.request)
+        )
+
+    async def retrieve_response(self):
+        if not settings.RECIPE_FAST_READS:
+            return await sync_to_async(super().retrieve)(
+                self.request, *self.args, **self.kwargs
+            )
+        queryset = await self.afilter_queryset(self.get_queryset())
+        try:
+            queryset = queryset.filter(pk=self.kwargs['pk'])
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        recipes = await aserialize_recipes(
+            [row async for row in recipe_values(queryset)], self.request
+        )
+        if not recipes:
+            raise Http404
+        return Response(recipes[0])
+
+    def apply_memberships(self, response, memberships):
+        """Кэшированный ответ общий, флаги пользователя ставим поверх."""
+        if response.status_code == status.HTTP_200_OK:
+            apply_memberships(response.data, memberships)
+        return response
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(methods=["get"], detail=False)
+    @action(
+        methods=["post"],
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+    )
+    def bulk(self, request):
+        """Создание массива рецептов одним запросом."""
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.RECIPE_BULK_LIMIT,
+        )
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save(author=request.user)
+        return Response(
+            SupportRecipesSerializer(
+                recipes, many=True, context=self.get_serializer_context()
+            ).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(
+        methods=["get"],
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+    )
     def download_shopping_cart(self, request):
-        return FileResponse(
-            get_shopping_list(request.user),
-            content_type='text/plain,charset=utf8',
-            as_attachment=True, filename="cart.txt"
+        renderer = request.accepted_renderer
+        # Под ASGI список читается асинхронно и не занимает поток,
+        # пока медленный клиент его скачивает.
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_shopping_list(request.user, renderer.format)
+        else:
+            content = iter_shopping_list(request.user, renderer.format)
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset=utf-8',
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="cart.{renderer.format}"'
         )
+        return response
+
+    @action(methods=["get"], detail=False)
+    def cook(self, request):
+        """Что приготовить из имеющихся ингредиентов.
+
+        ?ingredients=1,2,3 (или несколько параметров ingredients).
+        Рецепты идут от тех, для которых есть всё, к тем, для которых
+        есть меньшая доля ингредиентов; в missing_one — первые рецепты,
+        которым не хватает ровно одного, и этот ингредиент. Подбор идёт
+        по индексу в памяти, база читает только показанные рецепты.
+        """
+        serializer = PantrySerializer(data={'ingredients': [
+            value
+            for param in request.query_params.getlist('ingredients')
+            for value in param.split(',') if value
+        ]})
+        serializer.is_valid(raise_exception=True)
+        ingredient_ids = serializer.validated_data['ingredients']
+        match = pantry_index.match(ingredient_ids)
+
+        # ?cursor= здесь не к чему: порядок задаёт индекс, а не таблица.
+        paginator = PageLimitPagination()
+        page = paginator.paginate_queryset(match, request, view=self)
+        suggestions = match.missing_one()[
+            :paginator.get_page_size(request)
+        ]
+
+        recipe_ids = [recipe_id for recipe_id, _, _ in page + suggestions]
+        recipes = Recipe.objects.select_related(None).prefetch_related(
+            None
+        ).in_bulk(recipe_ids)
+        # Удалённые в другом процессе рецепты ещё могут быть в индексе.
+        deleted = set(recipe_ids).difference(recipes)
+        if deleted:
+            pantry_index.discard(deleted)
+        missing = {
+            row.recipe_id: row.ingredient
+            for row in IngredientsRecipe.objects.filter(
+                recipe_id__in=[recipe_id for recipe_id, _, _ in suggestions]
+            ).exclude(
+                ingredient_id__in=ingredient_ids
+            ).select_related('ingredient')
+        }
+
+        for recipe_id, covered, total in page + suggestions:
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.covered, recipe.total = covered, total
+                recipe.missing = missing.get(recipe_id)
+        context = self.get_serializer_context()
+        response = paginator.get_paginated_response(PantryRecipeSerializer(
+            [recipes[pk] for pk, _, _ in page if pk in recipes],
+            many=True, context=context,
+        ).data)
+        response.data['missing_one'] = PantrySuggestionSerializer(
+            [recipes[pk] for pk, _, _ in suggestions if missing.get(pk)],
+            many=True, context=context,
+        ).data
+        return response
+
+    @action(methods=["get"], detail=True)
+    def similar(self, request, pk=None):
+        """Рецепты, которые добавляют в избранное вместе с этим.
+
+        Список строит команда build_similar_recipes; здесь он читается
+        одной строкой по первичному ключу. ?limit= ограничивает длину.
+        """
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            if not limit.isdigit():
+                return Response(
+                    {'limit': 'Ожидается положительное целое число.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = int(limit)
+        try:
+            similar = similar_recipes(pk, limit)
+        except (TypeError, ValueError):
+            raise Http404
+        if not similar:
+            # Пустой список только у существующего рецепта.
+            get_object_or_404(Recipe.objects.select_related(None), pk=pk)
+            return Response([])
+
+        recipes = Recipe.objects.select_related(None).prefetch_related(
+            None
+        ).in_bulk([recipe_id for recipe_id, _ in similar])
+        for recipe_id, score in similar:
+            if recipe_id in recipes:
+                recipes[recipe_id].score = score
+        return Response(SimilarRecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _ in similar
+             if recipe_id in recipes],
+            many=True, context=self.get_serializer_context(),
+        ).data)
+
+    @action(methods=["get"], detail=False, permission_classes=(IsAdminUser,))
+    def cache_stats(self, request):
+        """Счётчики попаданий кэша ответов для анонимных пользователей."""
+        return Response(recipe_cache.stats())
 
 
 class FavoriteViewSet(RelationBaseViewSet):
     model = Favorite
+    membership = 'favorites'
     serializer_class = FavoriteSerializer
     permission_classes = (IsAuthenticated,)
 
 
 class PurchasingListViewSet(RelationBaseViewSet):
     model = PurchasingList
+    membership = 'cart'
+    lock_user = True
     serializer_class = PurchasingListSerializer
     permission_classes = (IsAuthenticated,)
 
 
-class SubscribeListView(ListAPIView):
+class FavoriteBulkViewSet(RelationBulkViewSet):
+    model = Favorite
+    membership = 'favorites'
+    permission_classes = (IsAuthenticated,)
+
+
+class PurchasingListBulkViewSet(RelationBulkViewSet):
+    model = PurchasingList
+    membership = 'cart'
+    lock_user = True
+    permission_classes = (IsAuthenticated,)
+
+    def after_add(self, recipe_ids):
+        add_to_shopping_list(self.request.user, *recipe_ids)
+
+    def after_remove(self, recipe_ids):
+        remove_from_shopping_list(self.request.user, *recipe_ids)
+
+    def before_clear(self):
+        clear_shopping_list(self.request.user)
+
+
+class SubscribeListView(AsyncReadOnlyMixin, ListAPIView):
     """Подписки"""
     serializer_class = SubscribeListSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = PageLimitPagination
+
+    async def get(self, request, *args, **kwargs):
+        return await self.list(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Follow.objects.filter(user=self.request.user)
+        return Follow.objects.filter(
+            user=self.request.user
+        ).select_related('author').annotate(
+            recipes_count=Count('author__recipes')
+        ).prefetch_related(
+            author_recipes_prefetch(
+                'author__recipes', get_recipes_limit(self.request)
+            )
+        ).order_by('id')
 
 
 class MainSubscribeViewSet(APIView):
@@ -112,6 +432,7 @@ class MainSubscribeViewSet(APIView):
             user=request.user,
             author_id=user_id
         )
+        recipe_memberships.invalidate(request.user.id, 'following')
         return Response(
             self.serializer_class(author, context={'request': request}).data,
             status=status.HTTP_201_CREATED
@@ -126,6 +447,7 @@ class MainSubscribeViewSet(APIView):
         )
         if subscription:
             subscription.delete()
+            recipe_memberships.invalidate(request.user.id, 'following')
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'error': 'Вы не подписаны на пользователя'},
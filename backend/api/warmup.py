@@ -0,0 +1,47 @@
+import logging
+import time
+
+from django.db import DatabaseError
+from django.urls import get_resolver
+
+from .ingredient_index import ingredient_index
+from .pantry import pantry_index
+from .tag_bits import tag_bits
+
+logger = logging.getLogger(__name__)
+
+
+def warm_urls():
+    # Импорт urls.py со всеми представлениями и компиляция шаблонов.
+    get_resolver().reverse_dict
+
+
+# Шаги прогрева в порядке выполнения: (название, функция).
+WARM_UP_STEPS = (
+    ('urls', warm_urls),
+    ('tags', tag_bits.warm),
+    ('ingredients', ingredient_index.refresh),
+    ('pantry', pantry_index.refresh),
+)
+
+
+def warm_up():
+    """Готовит процесс к первым запросам, возвращает {шаг: секунды}.
+
+    Загружает URLconf с представлениями, реестр тегов, индексы
+    ингредиентов и подбора рецептов, чтобы первые запросы после старта
+    воркера не платили за это сами. Недоступная база не мешает старту:
+    справочники тогда загрузятся при первом запросе.
+    """
+    timings = {}
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except DatabaseError:
+            logger.warning('Warm-up step %s failed', name, exc_info=True)
+        timings[name] = time.perf_counter() - start
+    logger.info('Warmed up: %s', ', '.join(
+        f'{name} {seconds * 1000:.0f} ms' for name, seconds in timings.items()
+    ))
+    return timings
@@ -0,0 +1,25 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+import threading
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+application = get_asgi_application()
+
+from api.warmup import warm_up  # noqa: E402
+
+# uvicorn imports the application inside the running event loop, where
+# the synchronous ORM is not allowed, so the warm-up runs in a thread.
+warm_up_thread = threading.Thread(target=warm_up)
+warm_up_thread.start()
+warm_up_thread.join()
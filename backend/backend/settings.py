@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,11 @@ TEMPLATES = [
 WSGI_APPLICATION = 'backend.wsgi.application'
 
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds. Django keeps a
+# connection per thread, and under ASGI synchronous code may run in a
+# different thread for every request, so an ASGI server without a
+# connection pooler in front of the database can exhaust its connection
+# limit; set DB_CONN_MAX_AGE=0 there to close them after each request.
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
@@ -70,10 +76,32 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default='60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Comma separated read replicas of the default database: host names for
+# PostgreSQL, file names for SQLite (see the sync_sqlite_replicas command).
+DATABASE_REPLICAS = []
+for replica in filter(None, os.getenv('DB_REPLICAS', default='').split(',')):
+    alias = f'replica{len(DATABASE_REPLICAS) + 1}'
+    location = (
+        'NAME' if 'sqlite' in DATABASES['default']['ENGINE'] else 'HOST'
+    )
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        location: replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+
+# How long a client reads from the primary after changing something.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default='10'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -107,6 +135,12 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
 AUTH_USER_MODEL = 'users.User'
 
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default='2'))
+
+RECIPE_BULK_LIMIT = int(os.getenv('RECIPE_BULK_LIMIT', default='100'))
+
+RECIPE_FAST_READS = os.getenv('RECIPE_FAST_READS', default='True') == 'True'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
@@ -136,4 +170,48 @@ DJOSER = {
     'HIDE_USERS': False,
 }
 
+# LocMemCache is per process: invalidations made by one worker do not
+# reach the others. Run several workers only with a shared cache
+# (docker-compose sets Redis); every cache also expires on its own.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', default='300'))
+
+MEMBERSHIPS_CACHE_TIMEOUT = int(
+    os.getenv('MEMBERSHIPS_CACHE_TIMEOUT', default='300')
+)
+
+TAG_BITS_CACHE_TIMEOUT = int(
+    os.getenv('TAG_BITS_CACHE_TIMEOUT', default='60')
+)
+
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', default='300'))
+
+PANTRY_INDEX_TTL = int(os.getenv('PANTRY_INDEX_TTL', default='3600'))
+
+PANTRY_INDEX_SYNC_INTERVAL = int(
+    os.getenv('PANTRY_INDEX_SYNC_INTERVAL', default='5')
+)
+
+# Ingredients in one recipe. The pantry index keeps the count per
+# recipe in int16, and a recipe with thousands of ingredients would
+# match almost every pantry.
+RECIPE_MAX_INGREDIENTS = int(
+    os.getenv('RECIPE_MAX_INGREDIENTS', default='100')
+)
+
+PANTRY_MAX_INGREDIENTS = int(
+    os.getenv('PANTRY_MAX_INGREDIENTS', default='100')
+)
+
+SIMILAR_RECIPES_TOP_K = int(os.getenv('SIMILAR_RECIPES_TOP_K', default='20'))
+
 CSRF_TRUSTED_ORIGINS = ['https://foodgrameats.ddns.net', 'https://www.foodgrameats.ddns.net']
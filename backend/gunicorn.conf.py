@@ -0,0 +1,88 @@
+"""Gunicorn settings for production.
+
+Gunicorn reads this file from the working directory, so the container
+runs just ``gunicorn backend.asgi``. Every value can be overridden with
+the GUNICORN_* environment variables below.
+
+The app is preloaded in the master and shared with the workers
+copy-on-write. Importing it warms up the URLconf, tag registry,
+ingredient index and pantry index (see backend/asgi.py), so with preload
+this happens once in the master, and without it once in every worker
+before it accepts traffic. Workers are recycled after a jittered number
+of requests, so they do not all restart at once, and log how long their
+cold start took.
+
+Caches and indexes in local memory are per process, so by default there
+is a single worker: with several, an invalidation made by one worker
+would not reach the others. With a shared cache (CACHE_BACKEND, Redis in
+docker-compose) there is one worker per CPU: uvicorn workers are async
+and each serves many requests at once, so the 2n+1 rule for sync workers
+does not apply.
+"""
+import multiprocessing
+import os
+import time
+
+
+def cpu_count():
+    # Only the CPUs this container may use, not all CPUs of the host.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def default_workers():
+    backend = os.getenv('CACHE_BACKEND', default='')
+    if not backend or backend.endswith('LocMemCache'):
+        return 1
+    return cpu_count()
+
+
+bind = os.getenv('GUNICORN_BIND', default='0.0.0.0:8000')
+worker_class = os.getenv(
+    'GUNICORN_WORKER_CLASS', default='uvicorn.workers.UvicornWorker'
+)
+workers = int(os.getenv('GUNICORN_WORKERS', default=str(default_workers())))
+preload_app = os.getenv('GUNICORN_PRELOAD', default='True') == 'True'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', default='1000'))
+max_requests_jitter = int(
+    os.getenv('GUNICORN_MAX_REQUESTS_JITTER', default=str(max_requests // 10))
+)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', default='30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', default='30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', default='5'))
+# Heartbeat files on tmpfs: a slow disk must not make workers look hung.
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def close_connections():
+    """Drop database and cache connections opened by the preloaded app."""
+    from django.conf import settings
+
+    if not settings.configured:
+        return
+    from django.core.cache import caches
+    from django.db import connections
+
+    connections.close_all()
+    for cache in caches.all(initialized_only=True):
+        cache.close()
+
+
+def pre_fork(server, worker):
+    # A socket shared by two processes mixes up their queries.
+    close_connections()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    close_connections()
+
+
+def post_worker_init(worker):
+    # Without preload this includes loading and warming up the app.
+    worker.log.info(
+        'Worker %s ready in %.0f ms',
+        worker.pid, (time.perf_counter() - worker.forked_at) * 1000,
+    )
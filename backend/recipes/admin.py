@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from recipes.models import (Favorite, Ingredient, IngredientsRecipe,
-                            PurchasingList, Recipe, Tag, TagsRecipe)
+                            PurchasingList, Recipe, ShoppingListItem, Tag,
+                            TagsRecipe)
 
 
 @admin.register(Tag)
@@ -49,3 +50,10 @@ class PurchasingListAdmin(admin.ModelAdmin):
     list_display = ('id', 'recipe', 'user',)
     list_filter = ('recipe', 'user',)
     search_fields = ('user',)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount',)
+    list_filter = ('user',)
+    search_fields = ('user',)
@@ -0,0 +1,162 @@
+"""Image variants of recipe pictures.
+
+The original is saved by the serializer. After the commit a worker pool
+verifies it, downscales it to IMAGE_VARIANT_WIDTHS and encodes every
+size as WebP and JPEG next to the original, several pictures in
+parallel. The pool only reads and writes files: once it is done, the
+request thread stores the generated names in Recipe.image_variants with
+a single query. When the picture is replaced, the variants of the old
+one are deleted by the same task.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_WIDTHS = (320, 640)
+IMAGE_VARIANT_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True},
+}
+
+_executor = None
+_executor_pid = None
+
+
+def get_executor():
+    """Пул потоков текущего процесса (после fork создаётся заново)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def variant_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}_{width}.{extension}'
+
+
+def render_variants(field_file):
+    """Строит варианты картинки, возвращает {width: {format: name}}."""
+    storage = field_file.storage
+    with storage.open(field_file.name) as source:
+        data = source.read()
+    with Image.open(BytesIO(data)) as image:
+        image.verify()
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        variants = {}
+        for width in IMAGE_VARIANT_WIDTHS:
+            resized = image.copy()
+            if resized.width > width:
+                resized.thumbnail((width, resized.height), Image.LANCZOS)
+            variants[str(width)] = {}
+            for extension, options in IMAGE_VARIANT_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, **options)
+                variants[str(width)][extension] = storage.save(
+                    variant_name(field_file.name, width, extension),
+                    ContentFile(buffer.getvalue()),
+                )
+    return variants
+
+
+def delete_variants(storage, variants):
+    """Удаляет файлы вариантов {width: {format: name}}."""
+    for formats in variants.values():
+        for name in formats.values():
+            try:
+                storage.delete(name)
+            except OSError:
+                logger.warning(
+                    'Image variant %s was not deleted', name, exc_info=True
+                )
+
+
+def render_image(field_file, replaced_variants=None):
+    """Задача пула: удаляет файлы прежних вариантов и строит новые.
+
+    Работает только с файлами: в базу варианты записывает поток запроса.
+    Возвращает None, если картинку не удалось обработать.
+    """
+    if replaced_variants:
+        delete_variants(field_file.storage, replaced_variants)
+    try:
+        return render_variants(field_file)
+    except Exception:
+        logger.exception('Image variants of %s failed', field_file.name)
+        return None
+
+
+def build_image_variants(images, replaced_variants):
+    """Строит варианты в пуле и записывает их в рецепты одним запросом.
+
+    images — {recipe_id: картинка}. Пул обрабатывает картинки
+    параллельно, а запись идёт из вызывающего потока, когда пул
+    закончил: запись из потоков пула спорила бы за базу с запросами
+    (на SQLite — «database is locked»). Рецепты, картинку которых
+    успели заменить, не трогаются.
+    """
+    from api.cache import recipe_cache
+    from recipes.models import Recipe
+
+    executor = get_executor()
+    futures = {
+        recipe_id: (image.name, executor.submit(
+            render_image, image, replaced_variants.get(recipe_id)
+        ))
+        for recipe_id, image in images.items()
+    }
+    rendered = {
+        recipe_id: (name, future.result())
+        for recipe_id, (name, future) in futures.items()
+    }
+    now = timezone.now()
+    with transaction.atomic():
+        current = Recipe.objects.select_related(None).prefetch_related(
+            None
+        ).select_for_update().only('id', 'image').filter(pk__in=rendered)
+        recipes = []
+        for recipe in current:
+            name, variants = rendered[recipe.pk]
+            if variants is None or recipe.image.name != name:
+                continue
+            recipe.image_variants = variants
+            recipe.updated_at = now
+            recipes.append(recipe)
+        Recipe.objects.bulk_update(
+            recipes, ('image_variants', 'updated_at')
+        )
+    if recipes:
+        recipe_cache.invalidate_recipes(*(recipe.pk for recipe in recipes))
+
+
+def schedule_image_variants(recipes, replaced_variants=None):
+    """Строит варианты картинок рецептов после коммита транзакции.
+
+    replaced_variants — {recipe_id: варианты прежней картинки}, их файлы
+    удаляются только после коммита: при откате рецепт остаётся со старой
+    картинкой и её вариантами.
+    """
+    images = {recipe.pk: recipe.image for recipe in recipes}
+    transaction.on_commit(
+        lambda: build_image_variants(images, replaced_variants or {})
+    )
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes.similar import rebuild_similar
+
+
+class Command(BaseCommand):
+    """Rebuild the similar recipes shown by /api/recipes/{id}/similar/.
+
+    Meant to run offline, e.g. nightly from cron: favorites added since
+    the last run are not seen until the next one. Memory grows with the
+    number of favorites and --chunk-products, not with the square of the
+    number of recipes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=settings.SIMILAR_RECIPES_TOP_K,
+            help='Similar recipes kept per recipe.',
+        )
+        parser.add_argument(
+            '--chunk-products', type=int, default=1_000_000,
+            help='Multiplications per chunk of recipes computed at once.',
+        )
+        parser.add_argument(
+            '--cart-weight', type=float, default=0.0,
+            help='Weight of a shopping cart entry, a favorite weighs 1.',
+        )
+        parser.add_argument(
+            '--database', default='default',
+            help='Database alias to rebuild.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        written = rebuild_similar(
+            top_k=options['top_k'],
+            chunk_products=options['chunk_products'],
+            cart_weight=options['cart_weight'],
+            using=options['database'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Similar recipes of {written} recipes built in '
+            f'{time.perf_counter() - start:.1f} s'
+        ))
@@ -1,28 +1,213 @@
 import csv
+import json
+import os
+import time
+from itertools import islice
 
-from django.core.management import BaseCommand
-
+from api.cache import recipe_cache
+from api.ingredient_index import ingredient_index
+from api.tag_bits import tag_bits
 from django.conf import settings
-from recipes.models import Ingredient, Tag
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from recipes.models import Ingredient, Recipe, Tag
 
+# Model: (default file, natural key, other fields).
 DATA = {
-    Ingredient: 'ingredients.csv',
-    Tag: 'tags.csv',
+    Ingredient: ('ingredients.csv', ('name', 'measurement_unit'), ()),
+    Tag: ('tags.csv', ('slug',), ('name', 'color')),
+}
+# Recipes that show a changed object, for Recipe.objects.touch().
+RECIPE_LOOKUPS = {
+    Ingredient: 'ingredients__in',
+    Tag: 'tags__in',
+}
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    yield from csv.DictReader(file)
+
+
+def iter_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_array(file):
+    """Yield objects of a JSON array one by one, reading it in chunks."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError('JSON input must be an array')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield item
+            position = end
+        buffer = buffer[position:]
+
+
+READERS = {
+    '.csv': iter_csv,
+    '.json': iter_json_array,
+    '.jsonl': iter_json_lines,
 }
 
 
 class Command(BaseCommand):
-    """Add data from csv. """
+    """Import ingredients and tags from CSV, JSON or JSON lines.
 
-    def handle(self, *args, **kwargs):
-        for model, file in DATA.items():
-            with open(
-                    f'{settings.BASE_DIR}/data/{file}',
-                    'r', encoding='utf-8',
-            ) as table:
-                reader = csv.DictReader(table)
-                model.objects.bulk_create(model(**data) for data in reader)
+    Rows are read as a stream and written in --batch-size batches, so
+    the size of the catalog is not limited by memory. Ingredients are
+    matched by name and measurement unit, tags by slug: existing rows
+    are updated, new ones created, so the import can be run again.
+    --dry-run only prints what would change.
+    """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients', default=None,
+            help='Ingredients file, data/ingredients.csv by default.',
+        )
+        parser.add_argument(
+            '--tags', default=None,
+            help='Tags file, data/tags.csv by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows read, compared and written at once.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Print the difference without writing anything.',
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        paths = {Ingredient: options['ingredients'], Tag: options['tags']}
+        if any(paths.values()):
+            paths = {model: path for model, path in paths.items() if path}
+        else:
+            paths = {
+                model: os.path.join(settings.BASE_DIR, 'data', file)
+                for model, (file, _, _) in DATA.items()
+            }
+
+        for model, path in paths.items():
+            self.import_file(model, path)
+
+        if not self.dry_run:
+            ingredient_index.invalidate()
+            tag_bits.invalidate()
+            recipe_cache.invalidate_all()
         self.stdout.write(self.style.SUCCESS(
-            'Data is loaded')
+            'Nothing is written: dry run' if self.dry_run else 'Data is loaded'
+        ))
+
+    def import_file(self, model, path):
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError(
+                f'{path}: expected one of {", ".join(READERS)} files'
+            )
+        totals = dict.fromkeys(('read', 'created', 'updated', 'unchanged'), 0)
+        start = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = reader(file)
+            try:
+                while batch := list(islice(rows, self.batch_size)):
+                    totals['read'] += len(batch)
+                    for name, count in self.sync_batch(model, batch).items():
+                        totals[name] += count
+            except (ValueError, KeyError) as error:
+                raise CommandError(
+                    f'{path}, near row {totals["read"]}: {error!r}'
+                )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {totals["read"]} read, '
+            f'{totals["created"]} created, {totals["updated"]} updated, '
+            f'{totals["unchanged"]} unchanged in {elapsed:.2f} s, '
+            f'{totals["read"] / (elapsed or 1):.0f} rows/s'
         )
+
+    def sync_batch(self, model, batch):
+        _, key_fields, value_fields = DATA[model]
+        incoming = {}
+        for row in batch:
+            values = {
+                field: row[field].strip()
+                for field in key_fields + value_fields
+            }
+            incoming[tuple(values[field] for field in key_fields)] = values
+
+        existing = {
+            tuple(getattr(obj, field) for field in key_fields): obj
+            for obj in model.objects.filter(**{
+                f'{key_fields[0]}__in': {key[0] for key in incoming}
+            })
+        }
+        created, updated = [], []
+        for key, values in incoming.items():
+            obj = existing.get(key)
+            if obj is None:
+                created.append(model(**values))
+                self.show('+', key, values)
+                continue
+            changes = {
+                field: values[field] for field in value_fields
+                if getattr(obj, field) != values[field]
+            }
+            if changes:
+                self.show('~', key, changes)
+                for field, value in changes.items():
+                    setattr(obj, field, value)
+                updated.append(obj)
+
+        if not self.dry_run and (created or updated):
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(created)
+                    if updated:
+                        model.objects.bulk_update(updated, value_fields)
+                        # bulk_update sends no post_save: mark the
+                        # recipes like touch_tag_recipes and
+                        # touch_ingredient_recipes do, or conditional
+                        # GETs keep answering 304.
+                        Recipe.objects.touch(
+                            **{RECIPE_LOOKUPS[model]: updated}
+                        )
+            except IntegrityError as error:
+                raise CommandError(
+                    f'{model._meta.verbose_name_plural}: {error}'
+                )
+        return {
+            'created': len(created),
+            'updated': len(updated),
+            'unchanged': len(incoming) - len(created) - len(updated),
+        }
+
+    def show(self, sign, key, values):
+        if self.dry_run:
+            self.stdout.write(f'{sign} {" / ".join(key)}: {values}')
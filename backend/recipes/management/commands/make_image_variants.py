@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+from recipes.images import render_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Build image variants for recipes that do not have them yet."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild variants of every recipe.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.select_related(None).prefetch_related(None)
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        done = failed = 0
+        for recipe in recipes.iterator():
+            try:
+                recipe.image_variants = render_variants(recipe.image)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{recipe.image.name}: {error}')
+                continue
+            recipe.save(update_fields=('image_variants', 'updated_at'))
+            done += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Variants built for {done} recipes, {failed} failed')
+        )
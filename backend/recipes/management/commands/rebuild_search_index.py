@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+from recipes.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """Refill the SQLite full-text search table from the recipes.
+
+    Needed after bulk_create() or QuerySet.update() of names and
+    descriptions, which bypass the signals. PostgreSQL keeps its index
+    up to date by itself.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default='default',
+            help='Database alias to rebuild.',
+        )
+
+    def handle(self, *args, **options):
+        if not rebuild_index(options['database']):
+            self.stdout.write('The database maintains the index itself')
+            return
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
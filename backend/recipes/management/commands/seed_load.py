@@ -0,0 +1,263 @@
+import random
+import time
+from itertools import accumulate, islice
+
+from api.cache import recipe_cache
+from api.services import rebuild_shopping_lists
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Max
+from recipes.models import (Favorite, Ingredient, IngredientsRecipe,
+                            PurchasingList, Recipe, ShoppingListItem, Tag,
+                            TagsRecipe, get_tags_mask)
+from recipes.search import rebuild_index
+from users.models import Follow
+
+User = get_user_model()
+
+SEED_IMAGE = 'foodgram/images/seed.png'
+SEED_PASSWORD = 'seed_load'
+
+
+def zipf_weights(count, alpha):
+    """Cumulative weights of ranks 1..count, p(rank) ~ 1 / rank**alpha."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+def batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    """Generate a synthetic dataset for load testing.
+
+    Creates users and recipes with 1-3 tags and 3-12 ingredients. Who
+    writes recipes, how popular a recipe or an author is and how active
+    a user is follow power laws, like on a real site: a few authors get
+    most of the followers and a few recipes most of the favorites.
+    Rows are written with bulk_create in --batch-size batches and
+    the speed of every table is reported. Tags and ingredients must be
+    loaded first (ingr_import).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--follows', type=int, default=None,
+            help='Total subscriptions, 10 per user by default.',
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=None,
+            help='Total favorites, 20 per user by default.',
+        )
+        parser.add_argument(
+            '--carts', type=int, default=None,
+            help='Total cart entries, 5 per user by default.',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Exponent of the power laws.',
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.alpha = options['alpha']
+        tags = list(Tag.objects.all())
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not tags or not ingredient_ids:
+            raise CommandError('Load tags and ingredients first: ingr_import')
+
+        users_count = options['users']
+        started = time.perf_counter()
+        user_ids = self.create_users(users_count)
+        recipe_ids, author_ids = self.create_recipes(
+            options['recipes'], user_ids, tags, ingredient_ids
+        )
+        self.create_relations(
+            'follows', Follow, 'author_id', user_ids, author_ids,
+            self.total(options['follows'], users_count, 10), exclude_self=True
+        )
+        self.create_relations(
+            'favorites', Favorite, 'recipe_id', user_ids, recipe_ids,
+            self.total(options['favorites'], users_count, 20)
+        )
+        self.create_relations(
+            'cart entries', PurchasingList, 'recipe_id', user_ids, recipe_ids,
+            self.total(options['carts'], users_count, 5)
+        )
+        self.timed('shopping list items', self.rebuild_shopping_lists,
+                   user_ids)
+        # bulk_create bypasses the signals that fill the SQLite search
+        # table.
+        if rebuild_index():
+            self.stdout.write('Search index is rebuilt')
+        recipe_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset is loaded in {time.perf_counter() - started:.1f} s')
+        )
+
+    @staticmethod
+    def total(value, users_count, per_user):
+        return users_count * per_user if value is None else value
+
+    def timed(self, name, function, *args):
+        start = time.perf_counter()
+        rows = function(*args)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{name:<20} {rows:>10} rows in {elapsed:7.2f} s, '
+            f'{rows / elapsed if elapsed else 0:>9.0f} rows/s'
+        )
+        return rows
+
+    def bulk_create(self, model, objects, created=None):
+        rows = 0
+        for batch in batches(objects, self.batch_size):
+            batch = model.objects.bulk_create(batch)
+            rows += len(batch)
+            if created is not None:
+                created.extend(obj.pk for obj in batch)
+        return rows
+
+    def create_users(self, count):
+        # Numbered after the largest id, not the number of users: after
+        # a deletion the count can point at a name that is taken. A seed
+        # user's id is never below its number, so names from earlier
+        # runs are below this one too.
+        first = (User.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        password = make_password(SEED_PASSWORD)
+        users = (
+            User(
+                username=f'seed_{first + i}',
+                email=f'seed_{first + i}@example.com',
+                first_name='Seed',
+                last_name=str(first + i),
+                password=password,
+            )
+            for i in range(count)
+        )
+        user_ids = []
+        self.timed('users', self.bulk_create, User, users, user_ids)
+        return user_ids
+
+    def create_recipes(self, count, user_ids, tags, ingredient_ids):
+        authors = user_ids[:]
+        self.random.shuffle(authors)
+        author_weights = zipf_weights(len(authors), self.alpha)
+        ingredients = ingredient_ids[:]
+        self.random.shuffle(ingredients)
+        ingredient_weights = zipf_weights(len(ingredients), self.alpha)
+
+        rows = {'recipes': 0, 'recipe tags': 0, 'recipe ingredients': 0}
+        elapsed = dict.fromkeys(rows, 0.0)
+        recipe_ids = []
+        for batch in batches(range(count), self.batch_size):
+            recipe_tags = [
+                self.random.sample(tags, self.random.randint(
+                    1, min(3, len(tags))
+                ))
+                for _ in batch
+            ]
+            start = time.perf_counter()
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'Seed recipe {i}',
+                    description='Generated by seed_load.',
+                    author_id=self.random.choices(
+                        authors, cum_weights=author_weights
+                    )[0],
+                    image=SEED_IMAGE,
+                    cooking_time=self.random.randint(5, 180),
+                    tags_mask=get_tags_mask(recipe_tags[position]),
+                )
+                for position, i in enumerate(batch)
+            )
+            elapsed['recipes'] += time.perf_counter() - start
+            rows['recipes'] += len(recipes)
+            recipe_ids.extend(recipe.id for recipe in recipes)
+
+            start = time.perf_counter()
+            rows['recipe tags'] += self.bulk_create(TagsRecipe, (
+                TagsRecipe(recipe_id=recipe.id, tag=tag)
+                for recipe, tags_of_recipe in zip(recipes, recipe_tags)
+                for tag in tags_of_recipe
+            ))
+            elapsed['recipe tags'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            rows['recipe ingredients'] += self.bulk_create(
+                IngredientsRecipe, (
+                    IngredientsRecipe(
+                        recipe_id=recipe.id,
+                        ingredient_id=ingredient_id,
+                        amount=self.random.randint(1, 500),
+                    )
+                    for recipe in recipes
+                    for ingredient_id in self.sample(
+                        ingredients, ingredient_weights,
+                        round(self.random.triangular(3, 12, 7)),
+                    )
+                )
+            )
+            elapsed['recipe ingredients'] += time.perf_counter() - start
+
+        for name in rows:
+            self.stdout.write(
+                f'{name:<20} {rows[name]:>10} rows in {elapsed[name]:7.2f} s'
+                f', {rows[name] / (elapsed[name] or 1):>9.0f} rows/s'
+            )
+        # Authors ordered by popularity: prolific ones get more followers.
+        return recipe_ids, authors
+
+    def sample(self, population, cum_weights, count, exclude=None):
+        """count distinct items of population drawn by cum_weights."""
+        count = min(count, len(population) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.random.choices(
+                population, cum_weights=cum_weights,
+                k=count - len(chosen),
+            ))
+            chosen.discard(exclude)
+        return chosen
+
+    def create_relations(self, name, model, field, user_ids, targets, total,
+                         exclude_self=False):
+        """total rows of model spread over users by a power law."""
+        if not targets or not user_ids:
+            return
+        # Rank in targets is popularity, rank of a user is activity.
+        target_weights = zipf_weights(len(targets), self.alpha)
+        users = user_ids[:]
+        self.random.shuffle(users)
+        activity = zipf_weights(len(users), self.alpha)
+        scale = total / activity[-1]
+        limit = len(targets) // 2 or 1
+
+        def objects():
+            previous = 0
+            for user_id, weight in zip(users, activity):
+                share = (weight - previous) * scale
+                previous = weight
+                count = min(limit, int(share + self.random.random()))
+                for target in self.sample(
+                        targets, target_weights, count,
+                        exclude=user_id if exclude_self else None,
+                ):
+                    yield model(user_id=user_id, **{field: target})
+
+        self.timed(name, self.bulk_create, model, objects())
+
+    def rebuild_shopping_lists(self, user_ids):
+        before = ShoppingListItem.objects.count()
+        for batch in batches(user_ids, self.batch_size):
+            rebuild_shopping_lists(batch, self.batch_size)
+        return ShoppingListItem.objects.count() - before
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='{width: {format: file name}}, filled by recipes.images.', verbose_name='resized copies of the picture'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Keeps the oldest of equal ingredients and moves references to it."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientsRecipe = apps.get_model('recipes', 'IngredientsRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    keepers = {}
+    duplicates = {}
+    for pk, name, unit in Ingredient.objects.order_by('id').values_list(
+        'id', 'name', 'measurement_unit'
+    ):
+        keeper = keepers.setdefault((name, unit), pk)
+        if keeper != pk:
+            duplicates[pk] = keeper
+    if not duplicates:
+        return
+    for model, owner in ((IngredientsRecipe, 'recipe_id'),
+                         (ShoppingListItem, 'user_id')):
+        for row in model.objects.filter(ingredient_id__in=duplicates):
+            keeper = duplicates[row.ingredient_id]
+            existing = model.objects.filter(
+                ingredient_id=keeper, **{owner: getattr(row, owner)}
+            ).first()
+            if existing is None:
+                row.ingredient_id = keeper
+                row.save(update_fields=('ingredient',))
+            else:
+                existing.amount += row.amount
+                existing.save(update_fields=('amount',))
+                row.delete()
+    Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_tag_bits'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# Statements per database vendor, see recipes.search.
+FORWARD = {
+    'postgresql': (
+        """
+        ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector(
+                'russian', translate(coalesce(name, ''), 'ёЁ', 'еЕ')
+            ), 'A')
+            || setweight(to_tsvector(
+                'russian', translate(coalesce(description, ''), 'ёЁ', 'еЕ')
+            ), 'B')
+        ) STORED
+        """,
+        """
+        CREATE INDEX recipes_recipe_search_vector
+        ON recipes_recipe USING gin (search_vector)
+        """,
+    ),
+    'sqlite': (
+        """
+        CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+            name, description, tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        INSERT INTO recipes_recipe_fts (rowid, name, description)
+        SELECT id,
+            replace(replace(name, 'ё', 'е'), 'Ё', 'Е'),
+            replace(replace(description, 'ё', 'е'), 'Ё', 'Е')
+        FROM recipes_recipe
+        """,
+    ),
+}
+BACKWARD = {
+    'postgresql': ('ALTER TABLE recipes_recipe DROP COLUMN search_vector',),
+    'sqlite': ('DROP TABLE recipes_recipe_fts',),
+}
+
+
+def add_search_index(apps, schema_editor):
+    for statement in FORWARD.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(statement)
+
+
+def remove_search_index(apps, schema_editor):
+    for statement in BACKWARD.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarRecipes',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar', serialize=False, to='recipes.recipe', verbose_name='recipe')),
+                ('recipe_ids', models.BinaryField(help_text='Recipe ids, little-endian int32.', verbose_name='similar recipes')),
+                ('scores', models.BinaryField(help_text='Cosine similarities, little-endian float32.', verbose_name='similarity')),
+            ],
+            options={
+                'verbose_name': 'Similar recipes',
+                'verbose_name_plural': 'Similar recipes',
+            },
+        ),
+    ]
@@ -1,11 +1,38 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models import Exists, OuterRef
+from django.utils import timezone
 
 User = get_user_model()
 
+# How many tags fit into Recipe.tags_mask, a signed BigIntegerField.
+TAG_BITS = 63
+
+
+class TagManager(models.Manager):
+
+    def free_bits(self):
+        used = set(self.values_list('bit', flat=True))
+        return (bit for bit in range(TAG_BITS) if bit not in used)
+
+    def assign_bits(self, tags):
+        """Give every tag without a bit the lowest free one."""
+        free_bits = self.free_bits()
+        for tag in tags:
+            if tag.bit is None:
+                tag.bit = next(free_bits, None)
+                if tag.bit is None:
+                    raise ValidationError(
+                        f'No more than {TAG_BITS} tags are supported.'
+                    )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self.assign_bits(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class Tag(models.Model):
     """Tags model."""
@@ -23,6 +50,14 @@ class Tag(models.Model):
         unique=True,
         verbose_name='tag slug',
     )
+    bit = models.PositiveSmallIntegerField(
+        unique=True,
+        editable=False,
+        verbose_name='tag bit',
+        help_text='Position of the tag in Recipe.tags_mask.',
+    )
+
+    objects = TagManager()
 
     class Meta:
         verbose_name_plural = 'Tags'
@@ -30,6 +65,23 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            Tag.objects.assign_bits((self,))
+        super().save(*args, **kwargs)
+
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+
+def get_tags_mask(tags):
+    """Bitmask of the given tags for Recipe.tags_mask."""
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
 
 class Ingredient(models.Model):
     """Ingredients model."""
@@ -45,6 +97,12 @@ class Ingredient(models.Model):
     class Meta:
         ordering = ['name']
         verbose_name_plural = 'Ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.measurement_unit}'
@@ -55,24 +113,34 @@ class RecipeManager(models.Manager):
     def get_queryset(self):
         qs = super().get_queryset()
         return qs.select_related(
-            'author').prefetch_related('tags')
+            'author').prefetch_related(
+            models.Prefetch('tags', queryset=Tag.objects.order_by('id'))
+        )
 
-    def fill_favs_and_in_cart(self, user):
-        if user.is_authenticated:
-            favorited = Favorite.objects.filter(
-                user=user,
-                recipe=OuterRef('pk')
-            )
-            in_cart = PurchasingList.objects.filter(
-                user=user,
-                recipe=OuterRef('pk')
-            )
-            return self.get_queryset().annotate(
-                is_favorited=Exists(favorited)).annotate(
-                    is_in_shopping_cart=Exists(in_cart))
+    def touch(self, **filters):
+        """Mark recipes as changed: their API representation is stale."""
+        return super().get_queryset().filter(**filters).update(
+            updated_at=timezone.now()
+        )
 
-        else:
-            return self.get_queryset()
+    def for_reading(self):
+        """Queryset for reading recipes with everything serializers need.
+
+        Tags and ingredients with their ingredient rows are prefetched
+        in a stable order (tag id, then the order ingredients were
+        added), so a page costs the same number of queries for any page
+        size and api.recipe_rows can reproduce the output.
+        The queryset does not depend on the user: favorites, cart and
+        subscriptions are filled in by api.memberships.
+        """
+        return self.get_queryset().prefetch_related(
+            models.Prefetch(
+                'ingredients_list',
+                queryset=IngredientsRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('id'),
+            )
+        )
 
 
 class Recipe(models.Model):
@@ -93,6 +161,13 @@ class Recipe(models.Model):
         'meal picture',
         upload_to='foodgram/images/',
     )
+    image_variants = models.JSONField(
+        'resized copies of the picture',
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text='{width: {format: file name}}, filled by recipes.images.',
+    )
     cooking_time = models.SmallIntegerField(
         validators=[MinValueValidator(
             1,
@@ -117,10 +192,22 @@ class Recipe(models.Model):
         related_name='recipes',
         verbose_name='Recipe tags',
     )
+    tags_mask = models.BigIntegerField(
+        'tag bitmask',
+        default=0,
+        editable=False,
+        help_text='OR of Tag.mask of the recipe tags, used by tag filter.',
+    )
     pub_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Publication date',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Last change',
+        help_text='Also bumped when tags, ingredients or the author change.',
+    )
 
     class Meta:
         ordering = ['-pub_date']
@@ -244,3 +331,66 @@ class PurchasingList(models.Model):
 
     def __str__(self):
         return f'{self.recipe} - {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """Aggregated amount of an ingredient in a user's shopping list."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='purchasing user',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='ingredient',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Total quantity',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient',),
+                name='unique_shopping_list_item',
+            ),
+        ]
+        verbose_name = 'Shopping list item'
+        verbose_name_plural = 'Shopping list items'
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}: {self.amount}'
+
+
+class SimilarRecipes(models.Model):
+    """Recipes most often favorited by the same users as this one.
+
+    One row per recipe, filled by the build_similar_recipes command.
+    Both fields are packed arrays in the same order, most similar
+    first; see recipes.similar.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='similar',
+        verbose_name='recipe',
+    )
+    recipe_ids = models.BinaryField(
+        verbose_name='similar recipes',
+        help_text='Recipe ids, little-endian int32.',
+    )
+    scores = models.BinaryField(
+        verbose_name='similarity',
+        help_text='Cosine similarities, little-endian float32.',
+    )
+
+    class Meta:
+        verbose_name = 'Similar recipes'
+        verbose_name_plural = 'Similar recipes'
+
+    def __str__(self):
+        return f'Similar to {self.recipe_id}'
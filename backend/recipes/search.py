@@ -0,0 +1,167 @@
+"""Full-text search over recipe names and descriptions.
+
+PostgreSQL: recipes_recipe.search_vector is a stored generated tsvector
+column (Russian configuration, the name weighs more than the
+description) with a GIN index, both created by migration 0007. It is
+not a model field: the database keeps it up to date and Django must not
+write it.
+
+SQLite: the recipes_recipe_fts FTS5 table, rowid = recipe id. SQLite
+has no Russian stemmer, so common Russian endings are cut off the
+search words and they match as prefixes instead. The table is kept in
+sync by the signals in api.signals. bulk_create and QuerySet.update()
+bypass them: the bulk recipe endpoint calls index_recipes() itself,
+seed_load calls rebuild_index(), which also catches up after any other
+bulk write.
+
+Neither stemmer knows that "ё" is written as "е", so both the text and
+the query spell it "е".
+
+Other databases fall back to icontains without ranking.
+"""
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# bm25 weights of the FTS5 columns: name, description.
+FTS_WEIGHTS = (10.0, 1.0)
+WORDS = re.compile(r'\w+')
+CYRILLIC_WORD = re.compile(r'[а-я]+')
+# Noun and adjective endings, longest first, and the shortest stem
+# left after cutting one.
+RUSSIAN_ENDINGS = sorted(
+    ('ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей',
+     'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ом', 'ем', 'ах', 'ях', 'ов',
+     'ев', 'ам', 'ям', 'ую', 'юю', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю',
+     'ь', 'й'),
+    key=len, reverse=True,
+)
+MIN_STEM = 3
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def sql_normalize(column):
+    """normalize() in SQL, the same in PostgreSQL and SQLite."""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def search_recipes(queryset, text):
+    """Recipes matching every word of text, best matches first."""
+    if not WORDS.search(text):
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return search_postgresql(queryset, text)
+    if vendor == 'sqlite':
+        return search_sqlite(queryset, text)
+    return queryset.filter(
+        Q(name__icontains=text) | Q(description__icontains=text)
+    )
+
+
+def search_postgresql(queryset, text):
+    query = SearchQuery(
+        normalize(text), config=SEARCH_CONFIG, search_type='websearch'
+    )
+    return queryset.alias(
+        search_vector=RawSQL(
+            f'"{Recipe._meta.db_table}"."search_vector"', [],
+            output_field=SearchVectorField(),
+        ),
+    ).filter(search_vector=query).alias(
+        search_rank=SearchRank(F('search_vector'), query),
+    ).order_by('-search_rank', '-pub_date', '-pk')
+
+
+def stem(word):
+    if CYRILLIC_WORD.fullmatch(word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                return word[:-len(ending)]
+    return word
+
+
+def match_expression(text):
+    # Quoted words: FTS5 operators typed by the user mean nothing.
+    return ' '.join(
+        f'"{stem(word)}"*' for word in WORDS.findall(normalize(text).lower())
+    )
+
+
+def search_sqlite(queryset, text):
+    # A join, not a subquery per recipe: bm25() would run the MATCH
+    # again for every row. The ORM has no other way to join a table
+    # without a model.
+    table = Recipe._meta.db_table
+    weights = ', '.join(map(str, FTS_WEIGHTS))
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match_expression(text)],
+        # bm25 is negative, the better the match the lower.
+        select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+    ).order_by('search_rank', '-pub_date', '-pk')
+
+
+def index_recipes(recipes, using=DEFAULT_DB_ALIAS):
+    """Put the recipes into the SQLite search table."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    recipes = list(recipes)
+    unindex_recipes([recipe.pk for recipe in recipes], using)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            'VALUES (%s, %s, %s)',
+            [(recipe.pk, normalize(recipe.name),
+              normalize(recipe.description))
+             for recipe in recipes],
+        )
+
+
+def unindex_recipes(pks, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not pks:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            f'({", ".join(["%s"] * len(pks))})',
+            pks,
+        )
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    """Create and refill the SQLite search table.
+
+    Returns False on databases that keep the index up to date
+    themselves.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            'name, description, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, {sql_normalize("name")}, '
+            f'{sql_normalize("description")} FROM {Recipe._meta.db_table}'
+        )
+    return True
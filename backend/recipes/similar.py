@@ -0,0 +1,165 @@
+"""Similar recipes from favorites of the same users.
+
+Recipes are similar when the same users favorite them: the cosine of
+their columns in the user x recipe matrix of favorites. Shopping cart
+entries can count too, with a smaller weight.
+
+build_similar() reads the favorites once and multiplies the matrix by
+itself a chunk of recipes at a time, keeping only the best top_k of
+every row. The recipe x recipe matrix is never held whole: a chunk is
+as many recipes as take about chunk_products multiplications, which
+bounds the size of its product, so a few popular recipes get a chunk
+of their own and thousands of rare ones share one. Memory is bounded by
+the favorites and one chunk, not by the square of the number of
+recipes. The build_similar_recipes command stores the result in
+SimilarRecipes, one row of packed arrays per recipe, and a request
+reads a single row by its primary key.
+"""
+from itertools import chain
+
+import numpy as np
+from django.db import DEFAULT_DB_ALIAS, transaction
+from scipy import sparse
+
+from .models import Favorite, PurchasingList, SimilarRecipes
+
+ID_DTYPE = np.dtype('<i4')
+SCORE_DTYPE = np.dtype('<f4')
+
+
+def pack(recipe_id, recipe_ids, scores):
+    return SimilarRecipes(
+        recipe_id=recipe_id,
+        recipe_ids=np.asarray(recipe_ids, dtype=ID_DTYPE).tobytes(),
+        scores=np.asarray(scores, dtype=SCORE_DTYPE).tobytes(),
+    )
+
+
+def unpack(recipe_ids, scores):
+    """Arrays of SimilarRecipes fields, read from the database."""
+    return (
+        np.frombuffer(recipe_ids, dtype=ID_DTYPE),
+        np.frombuffer(scores, dtype=SCORE_DTYPE),
+    )
+
+
+def similar_recipes(recipe_id, limit=None, using=None):
+    """[(id, score)] of recipes similar to recipe_id, best first."""
+    row = SimilarRecipes.objects.using(using).filter(
+        recipe_id=recipe_id
+    ).values_list('recipe_ids', 'scores').first()
+    if row is None:
+        return []
+    recipe_ids, scores = unpack(*row)
+    return [
+        (recipe_id, round(score, 4))
+        for recipe_id, score in zip(
+            recipe_ids[:limit].tolist(), scores[:limit].tolist()
+        )
+    ]
+
+
+def interactions(model, using):
+    """(user ids, recipe ids) of all rows of Favorite or PurchasingList."""
+    rows = model.objects.using(using).order_by().values_list(
+        'user_id', 'recipe_id'
+    )
+    pairs = np.fromiter(
+        chain.from_iterable(rows.iterator(chunk_size=10_000)),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def user_recipe_matrix(cart_weight, using):
+    """CSR user x recipe matrix and the recipe id of every column."""
+    users, recipes = interactions(Favorite, using)
+    weights = np.ones(len(users), dtype=np.float32)
+    if cart_weight:
+        cart_users, cart_recipes = interactions(PurchasingList, using)
+        users = np.concatenate((users, cart_users))
+        recipes = np.concatenate((recipes, cart_recipes))
+        weights = np.concatenate((
+            weights, np.full(len(cart_users), cart_weight, dtype=np.float32)
+        ))
+    user_ids, rows = np.unique(users, return_inverse=True)
+    recipe_ids, columns = np.unique(recipes, return_inverse=True)
+    # Duplicates (in favorites and in the cart) are summed.
+    matrix = sparse.csr_matrix(
+        (weights, (rows, columns)), shape=(len(user_ids), len(recipe_ids))
+    )
+    return matrix, recipe_ids
+
+
+def chunks(products, limit):
+    """(start, stop) of runs of rows with at most limit products in all.
+
+    A row with more than limit products is a run of its own.
+    """
+    total = np.cumsum(products)
+    start = 0
+    while start < len(products):
+        done = total[start - 1] if start else 0
+        stop = int(np.searchsorted(total, done + limit, side='right'))
+        stop = max(stop, start + 1)
+        yield start, stop
+        start = stop
+
+
+def build_similar(top_k=20, chunk_products=1_000_000, cart_weight=0.0,
+                  using=DEFAULT_DB_ALIAS):
+    """Yield (recipe id, similar ids, scores) for every favorited recipe.
+
+    Recipes without a single co-favorite are not yielded.
+    """
+    matrix, recipe_ids = user_recipe_matrix(cart_weight, using)
+    if not matrix.nnz:
+        return
+    by_recipe = matrix.T.tocsr()
+    norms = np.sqrt(by_recipe.multiply(by_recipe).sum(axis=1)).A1
+    # Row of a recipe in its product: a product per favorite of each
+    # user who favorited it.
+    favorites_per_user = np.diff(matrix.indptr)
+    products = by_recipe.astype(bool) @ favorites_per_user
+    for start, stop in chunks(products, chunk_products):
+        chunk = (by_recipe[start:stop] @ matrix).tocoo()
+        rows, columns, scores = chunk.row, chunk.col, chunk.data
+        # A recipe is not similar to itself.
+        keep = columns != rows + start
+        rows, columns, scores = rows[keep], columns[keep], scores[keep]
+        scores = scores / (norms[rows + start] * norms[columns])
+
+        # Best first within every row; equal scores: newer recipes.
+        order = np.lexsort((-recipe_ids[columns], -scores, rows))
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        starts = np.searchsorted(rows, np.arange(stop - start))
+        ends = np.searchsorted(rows, np.arange(stop - start), side='right')
+        for row in np.flatnonzero(ends > starts):
+            best = slice(starts[row], min(ends[row], starts[row] + top_k))
+            yield (
+                int(recipe_ids[start + row]),
+                recipe_ids[columns[best]],
+                scores[best],
+            )
+
+
+def rebuild_similar(top_k=20, chunk_products=1_000_000, cart_weight=0.0,
+                    batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """Replace SimilarRecipes with a fresh build, returns rows written.
+
+    One transaction: until it commits, requests read the old rows.
+    """
+    written = 0
+    with transaction.atomic(using=using):
+        SimilarRecipes.objects.using(using).all().delete()
+        batch = []
+        for similar in build_similar(
+                top_k, chunk_products, cart_weight, using):
+            batch.append(pack(*similar))
+            if len(batch) == batch_size:
+                SimilarRecipes.objects.using(using).bulk_create(batch)
+                written += len(batch)
+                batch = []
+        SimilarRecipes.objects.using(using).bulk_create(batch)
+        written += len(batch)
+    return written